@@ -0,0 +1,120 @@
+import argparse
+import logging
+import os
+import re
+import sys
+import time
+from run_script import (BUILT_FILES, EXPECTED_FILES, WEEK_PARTITIONS, add_run_options, check_run_options,
+                        collect_files, dropped_columns, is_partition, make_cleaned_folder, print_dropped_columns,
+                        run_options, run_weeks)
+
+# Week folders under the root folder: week1, Week 12, week_07...
+DEFAULT_WEEK_PATTERN = r'(?i)^week[ _-]?(\d+)$'
+
+# Load jobs running at once, and cleaned reports waiting for one
+DEFAULT_UPLOADS = 4
+
+def week_folder(value):
+    """argparse type for FOLDER=WEEK."""
+    folder, _, week_num = value.rpartition('=')
+    if not folder or not week_num.strip().isdigit():
+        raise argparse.ArgumentTypeError(f"expected FOLDER=WEEK with a whole week number, got {value!r}")
+    return folder.strip('"'), int(week_num)
+
+def find_week_folders(root, pattern=DEFAULT_WEEK_PATTERN):
+    """
+    The (folder, week number) of each folder directly under root whose name
+    matches pattern; the pattern's first group is the week number.
+    """
+    week_folders = []
+    for name in sorted(os.listdir(root)):
+        match = re.search(pattern, name)
+        if match and os.path.isdir(os.path.join(root, name)):
+            week_folders.append((os.path.join(root, name), int(match.group(1))))
+    return week_folders
+
+def summary_rows(records, missing):
+    """One (week, report, status, rows, seconds) row per report, in week order."""
+    rows = [(record['week'], record['report'], record['status'],
+             record['stages'].get('write', {}).get('rows'),
+             sum(stage['seconds'] for stage in record['stages'].values()) if record['stages'] else None)
+            for record in records]
+    rows += [(week, filename.replace('.csv', ''), 'missing', None, None) for week, filename in missing]
+    report_order = [filename.replace('.csv', '') for filename in [*EXPECTED_FILES, *BUILT_FILES]]
+    return sorted(rows, key=lambda row: (int(row[0].replace('week', '')), report_order.index(row[1])))
+
+def print_summary(rows, elapsed, dropped=None):
+    print()
+    print(f"{'Week':<10}{'Report':<20}{'Status':<15}{'Rows':>10}{'Seconds':>10}")
+    for week, report, status, row_count, seconds in rows:
+        row_count = f"{row_count:,}" if row_count is not None else '-'
+        seconds = f"{seconds:.1f}" if seconds is not None else '-'
+        print(f"{week:<10}{report:<20}{status:<15}{row_count:>10}{seconds:>10}")
+
+    statuses = [row[2] for row in rows]
+    counts = ', '.join(f"{statuses.count(status)} {status}" for status in dict.fromkeys(statuses))
+    print(f"\n{len(set(row[0] for row in rows))} weeks, {counts} in {elapsed:.1f}s")
+    print_dropped_columns(dropped or {})
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Clean and upload many weeks of exports in one run, without prompts.")
+    parser.add_argument('root', nargs='?',
+                        help="Folder holding one folder per week (week1, week2...), each with that week's "
+                             "exports.")
+    parser.add_argument('--pattern', default=DEFAULT_WEEK_PATTERN,
+                        help="Regular expression the week folders under root must match; its first group is "
+                             "the week number (default: week1, Week 12, week_07...).")
+    parser.add_argument('--week', dest='week_folders', type=week_folder, action='append', default=[],
+                        metavar='FOLDER=WEEK',
+                        help="A folder of exports and its week number; may be repeated, and wins over a week "
+                             "folder found under root with the same number.")
+    parser.add_argument('--uploads', type=int, default=DEFAULT_UPLOADS,
+                        help="Load jobs running at once; cleaning pauses while this many cleaned reports "
+                             f"are waiting for one (default {DEFAULT_UPLOADS}).")
+    add_run_options(parser)
+    args = parser.parse_args(argv)
+    check_run_options(parser, args)
+    if not args.root and not args.week_folders:
+        parser.error("give a root folder, --week FOLDER=WEEK, or both")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # Week number -> folder; an explicit --week replaces the found folder
+    folders = {}
+    if args.root:
+        folders.update({week_num: folder for folder, week_num in find_week_folders(args.root, args.pattern)})
+    folders.update({week_num: folder for folder, week_num in args.week_folders})
+    if not folders:
+        print(f"❌ No week folders found under {args.root}.")
+        return 1
+
+    if args.partitioned:
+        invalid = [week_num for week_num in folders if not is_partition(week_num)]
+        if invalid:
+            print(f"❌ Week numbers must be from {WEEK_PARTITIONS.start} to {WEEK_PARTITIONS.stop - 1} to load "
+                  f"into partitioned tables: {', '.join(map(str, sorted(invalid)))}.")
+            return 1
+
+    cleaned_folder = make_cleaned_folder()
+
+    weeks = []
+    missing = []
+    for week_num in sorted(folders):
+        week = f"week{week_num}"
+        files = collect_files(folders[week_num], week, several_weeks=True)
+        missing += [(week, filename) for filename in EXPECTED_FILES if filename not in dict(files)]
+        weeks.append((week, week_num if args.partitioned else None, files))
+
+    logging.info(f"Backfilling {len(weeks)} weeks: {', '.join(week for week, partition, files in weeks)}")
+    start = time.perf_counter()
+    records = run_weeks(weeks, cleaned_folder, max_uploads=args.uploads, **run_options(args))
+    print_summary(summary_rows(records, missing), time.perf_counter() - start, dropped_columns(records))
+
+    failed = [record for record in records if record['status'] not in ('uploaded', 'cleaned', 'skipped')]
+    return 1 if failed or missing else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
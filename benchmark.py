@@ -0,0 +1,269 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+from run_metrics import peak_rss_mb
+
+# Rows per block when writing the synthetic files, so even the 1M-row
+# files are generated without holding them in memory
+GENERATE_BLOCK_ROWS = 100000
+
+DEFAULT_ROWS = [10000, 100000, 1000000]
+DEFAULT_BASELINE = 'benchmark_baseline.json'
+
+# Column layouts of the four exports: (header, kind of value). The named
+# columns are the ones the cleaning converts; the rest carry free text of
+# the same shape as the real exports.
+EXPORTED_ORDERS_LAYOUT = [
+    ('RowNumber', 'int'), ('OrderId', 'int'), ('CreationDate', 'date'), ('BatchOrderId', 'int'),
+    ('TotPackages', 'small_int'), ('ParcelLabelType', 'small_int'), ('SmallParcelShipDate', 'date'),
+    ('TotalItemQty', 'small_int'), ('TotVolumeImperial', 'float'),
+    ('ReferenceNum', 'code'), ('PurchaseOrderNum', 'code'), ('Customer', 'text'), ('Facility', 'text'),
+    ('ShipToName', 'text'), ('ShipToCompany', 'text'), ('ShipToAddress1', 'address'),
+    ('ShipToAddress2', 'sparse'), ('ShipToCity', 'text'), ('ShipToState', 'state'), ('ShipToZip', 'zip'),
+    ('ShipToCountry', 'country'), ('ShipToPhone', 'code'), ('ShipToEmail', 'text'), ('Carrier', 'text'),
+    ('ShipService', 'text'), ('BillingType', 'text'), ('TrackingNumber', 'tracking'), ('Notes', 'notes'),
+    ('ShipNotes', 'notes'), ('TotWeightImperial', 'float'), ('Status', 'text'), ('ProcessDate', 'date'),
+    ('SKUs', 'code'),
+]
+
+STAMP_ORDERS_LAYOUT = [
+    ('Tracking #', 'tracking'), ('Postal Code', 'zip'), ('Date Printed', 'date'), ('Date Delivered', 'date'),
+    ('Quoted Amount', 'float'), ('Extra Services', 'sparse_float'), ('Origin Zip', 'zip'),
+    ('Insured For', 'sparse_int'), ('Duties and Taxes Amount', 'sparse_int'),
+    ('Cost Code', 'empty'), ('Refund Request Date', 'empty'), ('Refund Status', 'sparse'),
+    ('Refund Requested', 'empty'), ('Reference 1', 'code'), ('Order ID', 'code'), ('Store', 'empty'),
+    ('Order Date', 'empty'), ('Order Total', 'empty'), ('Item SKUs', 'empty'), ('Items', 'empty'),
+    ('Product Total', 'empty'), ('Shipping Paid', 'empty'), ('Tax Paid', 'empty'),
+    ('Address 2', 'sparse'), ('Address 3', 'empty'),
+    ('Recipient', 'text'), ('Company', 'text'), ('Address 1', 'address'), ('City', 'text'),
+    ('State/Province', 'state'), ('Country', 'country'), ('Carrier', 'text'), ('Service', 'text'),
+    ('Package', 'text'), ('Weight (lb)', 'float'), ('Length', 'small_int'), ('Width', 'small_int'),
+    ('Height', 'small_int'), ('Delivery Status', 'text'), ('User', 'text'), ('Cost Center', 'text'),
+    ('Printed Message', 'notes'), ('Email', 'text'), ('Phone', 'code'),
+]
+
+EXTENSIV_TXREGRPT_LAYOUT = [
+    ('TransactionID', 'int'), ('Customer', 'text'), ('Facility', 'text'), ('ReferenceNum', 'code'),
+    ('PurchaseOrderNum', 'code'), ('ShipToName', 'text'), ('ShipToAddress1', 'address'),
+    ('ShipToCity', 'text'), ('ShipToState', 'state'), ('ShipToZip', 'zip'), ('Carrier', 'text'),
+    ('ShipService', 'text'), ('TrackingNumber', 'tracking'), ('CreationDate', 'date'),
+    ('ProcessDate', 'date'), ('TotalItemQty', 'small_int'), ('TotWeight', 'float'),
+    ('TotVolume', 'float'), ('Packages', 'small_int'), ('Status', 'text'), ('Notes', 'notes'),
+    ('Charges', 'float'),
+]
+
+POSTAGE_COMPARISON_LAYOUT = [
+    ('OrderId', 'int'), ('TrackingNumber', 'tracking'), ('SmallParcelShipDate', 'date'),
+    ('Carrier', 'text'), ('ShipService', 'text'), ('ShipToZip', 'zip'), ('TotWeightImperial', 'float'),
+    ('TotVolumeImperial', 'float'), ('Postage Cost', 'float'), ('Notes', 'notes'),
+]
+
+WORDS = ['North', 'Main', 'Oak', 'Parcel', 'Ground', 'Priority', 'Express', 'Acme', 'Supply', 'Retail',
+         'Warehouse', 'Cedar', 'Hill', 'Lake', 'Market', 'Summit', 'Valley', 'Harbor', 'River', 'Park']
+STATES = ['CA', 'NY', 'TX', 'FL', 'WA', 'IL', 'OH', 'GA', 'NC', 'PA']
+COUNTRIES = ['US', 'US', 'US', 'CA', 'MX']
+MALFORMED_DATES = ['N/A', '13/45/2024', '2024-02-30 25:61:00', 'yesterday']
+
+def generate_column(rng, kind, rows):
+    if kind == 'int':
+        return rng.integers(1, 10_000_000, rows).astype(str).astype(object)
+    if kind == 'small_int':
+        return rng.integers(0, 20, rows).astype(str).astype(object)
+    if kind == 'float':
+        return np.round(rng.uniform(0, 250, rows), 2).astype(str).astype(object)
+    if kind == 'date':
+        seconds = rng.integers(0, 365 * 24 * 3600, rows).astype('timedelta64[s]')
+        values = np.datetime_as_string(np.datetime64('2024-01-01T00:00:00') + seconds)
+        return np.char.replace(values, 'T', ' ').astype(object)
+    if kind == 'zip':
+        return np.char.zfill(rng.integers(501, 99950, rows).astype(str), 5).astype(object)
+    if kind == 'tracking':
+        return np.char.add('9400', rng.integers(10 ** 17, 10 ** 18, rows).astype(str)).astype(object)
+    if kind == 'code':
+        return np.char.add('PO-', rng.integers(0, 10 ** 8, rows).astype(str)).astype(object)
+    if kind in ('text', 'notes', 'address'):
+        first = np.array(WORDS)[rng.integers(0, len(WORDS), rows)]
+        second = np.array(WORDS)[rng.integers(0, len(WORDS), rows)]
+        values = np.char.add(np.char.add(first, ' '), second)
+        if kind == 'address':
+            values = np.char.add(np.char.add(rng.integers(1, 9999, rows).astype(str), ' '), values)
+        return values.astype(object)
+    if kind == 'state':
+        return np.array(STATES, dtype=object)[rng.integers(0, len(STATES), rows)]
+    if kind == 'country':
+        return np.array(COUNTRIES, dtype=object)[rng.integers(0, len(COUNTRIES), rows)]
+    if kind == 'sparse':
+        values = generate_column(rng, 'text', rows)
+        values[rng.random(rows) < 0.9] = ''
+        return values
+    if kind == 'sparse_float':
+        values = generate_column(rng, 'float', rows)
+        values[rng.random(rows) < 0.95] = ''
+        return values
+    if kind == 'sparse_int':
+        values = generate_column(rng, 'small_int', rows)
+        values[rng.random(rows) < 0.8] = ''
+        return values
+    if kind == 'empty':
+        return np.full(rows, '', dtype=object)
+    raise ValueError(f"Unknown column kind: {kind}")
+
+def add_dirt(rng, columns, layout, rows, ragged):
+    """Mess up a block the way real exports are messy."""
+    for values, (name, kind) in zip(columns, layout):
+        if kind == 'notes':
+            # Free text with line breaks and stray whitespace, quoted by csv.writer
+            picked = rng.random(rows) < 0.02
+            values[picked] = [f"  {v}\r\nsee attached\n " for v in values[picked]]
+        elif kind == 'date':
+            picked = rng.random(rows) < 0.01
+            values[picked] = rng.choice(MALFORMED_DATES + [''], picked.sum())
+        elif kind == 'tracking':
+            # Stamps writes blank labels as = or ""
+            picked = rng.random(rows) < 0.02
+            values[picked] = rng.choice(['', '=', '""'], picked.sum())
+        elif kind in ('int', 'float'):
+            picked = rng.random(rows) < 0.005
+            values[picked] = rng.choice(['', 'N/A', '#NUM!', '1,234'], picked.sum())
+
+    block = list(zip(*columns))
+    if ragged:
+        width = len(layout)
+        for i in np.flatnonzero(rng.random(rows) < 0.002):
+            cut = int(rng.integers(1, width // 2))
+            block[i] = block[i][:width - cut] if rng.random() < 0.5 else block[i] + ('extra',) * cut
+    return block
+
+def generate_csv(path, layout, rows, seed, ragged=True):
+    rng = np.random.default_rng(seed)
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow([name for name, kind in layout])
+        for start in range(0, rows, GENERATE_BLOCK_ROWS):
+            block_rows = min(GENERATE_BLOCK_ROWS, rows - start)
+            columns = [generate_column(rng, kind, block_rows) for name, kind in layout]
+            writer.writerows(add_dirt(rng, columns, layout, block_rows, ragged))
+
+# Report name -> (layout, whether rows may be short or long). Extensiv
+# TxRegRpt rejects any file with a bad row, so its rows keep their width.
+REPORTS = {
+    'Exported Orders': (EXPORTED_ORDERS_LAYOUT, True),
+    'Stamps Orders': (STAMP_ORDERS_LAYOUT, True),
+    'ExtensivTxRegRpt': (EXTENSIV_TXREGRPT_LAYOUT, False),
+    'Postage Comparison': (POSTAGE_COMPARISON_LAYOUT, True),
+}
+
+def run_case(report, file_path, work_dir, repeat):
+    """
+    Clean one file repeat times in this (fresh) process. Returns the fastest
+    time in seconds and the peak memory.
+    """
+    # Cleaning logs go to the scratch folder, not the project's log files
+    os.chdir(work_dir)
+    import logging
+    import run_script
+    from clean_exported_postage_comparison import clean_postage_comparison
+    from quarantine import Quarantine, quarantining
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+    root.addHandler(logging.FileHandler(os.path.join(work_dir, 'benchmark.log'), encoding='utf-8'))
+
+    cleaners = {
+        'Exported Orders': lambda: run_script.process_exported_orders(file_path, 'week1'),
+        'Stamps Orders': lambda: run_script.process_stamp_orders(file_path, 'week1'),
+        'ExtensivTxRegRpt': lambda: run_script.process_extensiv_txregrpt(file_path, 'week1'),
+        'Postage Comparison': lambda: clean_postage_comparison(file_path),
+    }
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with quarantining(Quarantine(os.path.join(work_dir, 'quarantine.jsonl'))):
+            cleaners[report]()
+        times.append(time.perf_counter() - start)
+    return min(times), peak_rss_mb()
+
+def measure(report, file_path, work_dir, repeat):
+    # A new process per case, so peak memory belongs to this case alone
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        return pool.apply(run_case, (report, file_path, work_dir, repeat))
+
+def compare(result, baseline):
+    if baseline is None:
+        return ''
+    change = (result['rows_per_sec'] / baseline['rows_per_sec'] - 1) * 100
+    return f"{change:+.1f}% rows/sec, {result['peak_mb'] - baseline['peak_mb']:+.0f} MB"
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Time the cleaning of synthetic exports. Runs offline; nothing is uploaded.")
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROWS,
+                        help=f"Data rows per generated file (default {' '.join(map(str, DEFAULT_ROWS))}).")
+    parser.add_argument('--reports', nargs='+', choices=list(REPORTS), default=list(REPORTS),
+                        help="Reports to benchmark (default all four).")
+    parser.add_argument('--seed', type=int, default=1234,
+                        help="Seed for the data generators; the same seed gives the same files.")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="Times each file is cleaned; the fastest run counts (default 3).")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE,
+                        help=f"Results to compare against (default {DEFAULT_BASELINE}).")
+    parser.add_argument('--save-baseline', action='store_true',
+                        help="Store this run's results as the new baseline.")
+    parser.add_argument('--tolerance', type=float, default=10.0,
+                        help="Percent drop in rows/sec counted as a regression (default 10).")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    results = {}
+    regressions = []
+    work_dir = tempfile.mkdtemp(prefix='benchmark_')
+    try:
+        print(f"{'Report':<20} {'Rows':>9} {'Seconds':>9} {'Rows/sec':>11} {'Peak MB':>9}  vs baseline")
+        for report in args.reports:
+            layout, ragged = REPORTS[report]
+            for rows in args.rows:
+                file_path = os.path.join(work_dir, f"{report} {rows}.csv")
+                generate_csv(file_path, layout, rows, args.seed + rows, ragged)
+                seconds, peak_mb = measure(report, file_path, work_dir, args.repeat)
+                os.remove(file_path)
+
+                key = f"{report}/{rows}"
+                results[key] = {'seconds': round(seconds, 3), 'rows_per_sec': round(rows / seconds),
+                                'peak_mb': round(peak_mb, 1)}
+                print(f"{report:<20} {rows:>9} {seconds:>9.2f} {rows / seconds:>11,.0f} {peak_mb:>9.0f}  "
+                      f"{compare(results[key], baseline.get(key))}")
+
+                if key in baseline and \
+                        results[key]['rows_per_sec'] < baseline[key]['rows_per_sec'] * (1 - args.tolerance / 100):
+                    regressions.append(key)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.save_baseline:
+        baseline.update(results)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"✅ Baseline saved to {args.baseline}")
+
+    if regressions:
+        print(f"⚠️ Slower than the baseline by more than {args.tolerance:g}%: {', '.join(regressions)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
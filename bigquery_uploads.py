@@ -0,0 +1,92 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+_client = None
+_client_lock = threading.Lock()
+_warmup = None
+
+
+def get_client():
+    """Return the BigQuery client shared by every upload in this process."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            # Imported here so a run that never uploads doesn't pay for it
+            from google.cloud import bigquery
+            _client = bigquery.Client()
+        return _client
+
+
+def warm_client():
+    """
+    Start creating the shared client on a background thread, so credential
+    discovery overlaps with cleaning instead of delaying the first upload.
+    Any error is raised again by the get_client() call that needs it.
+    """
+    global _warmup
+    if _warmup is None:
+        _warmup = threading.Thread(target=_warm, daemon=True)
+        _warmup.start()
+
+
+def _warm():
+    try:
+        get_client()
+    except Exception:
+        pass
+
+
+class LoadJobs:
+    """
+    Runs load jobs for several reports at once into sink (see sinks.py).
+
+    submit() returns straight away; the upload and the wait for the job both
+    happen on a worker thread, so the total time is roughly that of the
+    slowest job. results() yields (key, job, error) as each job finishes.
+    With max_pending, submit() waits while that many jobs are unfinished.
+    """
+
+    def __init__(self, sink, max_workers=None, max_pending=None):
+        self._sink = sink
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._futures = {}
+        self._slots = threading.BoundedSemaphore(max_pending) if max_pending else None
+
+    def submit(self, key, start_job):
+        """start_job(sink) must start a load job and return it."""
+        if self._slots:
+            self._slots.acquire()
+        self._futures[self._pool.submit(self._run, start_job)] = key
+
+    def _run(self, start_job):
+        try:
+            job = start_job(self._sink)
+            job.result()
+            return job
+        finally:
+            if self._slots:
+                self._slots.release()
+
+    def _collect(self, future):
+        key = self._futures.pop(future)
+        try:
+            return key, future.result(), None
+        except Exception as e:
+            return key, None, e
+
+    def finished(self):
+        """Yield (key, job, error) for the jobs already finished, without waiting."""
+        for future in [future for future in self._futures if future.done()]:
+            yield self._collect(future)
+
+    def drain(self):
+        """Yield (key, job, error) for every job submitted so far, as each finishes; more can be submitted after."""
+        for future in as_completed(list(self._futures)):
+            yield self._collect(future)
+
+    def results(self):
+        try:
+            yield from self.drain()
+        finally:
+            self._pool.shutdown()
+            self._futures = {}
@@ -1,19 +1,27 @@
+import argparse
 import csv
-import pandas as pd
 import logging
-from google.cloud import bigquery  # Import BigQuery client
+from bigquery_uploads import get_client, warm_client
+from report_schemas import bigquery_schema, report_budget
+from report_specs import ReportSpec, read_report, report_plan
+from quarantine import Quarantine, quarantining
 import os  # Import os for file handling
 
 # Configure logging
 logging.basicConfig(filename='exported_orders_cleaning.log', level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Define the expected number of columns
-expected_columns = 33
+# The export's width and rules, in report_specs.py; the headers are kept as
+# they are in the file
+SPEC = ReportSpec('Exported Orders', 33, clean_names=False)
 
-# Lists to store valid and problematic rows
-valid_rows = []
-problematic_rows = []
+# Problematic rows allowed before the file is rejected, from report_schemas.py
+budget = report_budget('Exported Orders')
+
+# --clean-only checks an export without uploading it, or needing BigQuery credentials
+parser = argparse.ArgumentParser(description="Clean an Exported Orders export and upload it to BigQuery.")
+parser.add_argument('--clean-only', action='store_true', help="Clean and save the file without uploading it.")
+args = parser.parse_args()
 
 # Prompt user for file path
 file_path = input("Please drop the file path of the CSV file to process: ")
@@ -21,81 +29,24 @@ file_path = input("Please drop the file path of the CSV file to process: ")
 # Prompt user for table name
 table_name = input("Please enter a name for the table: ")
 
+# Start BigQuery credential discovery while the file is cleaned
+if not args.clean_only:
+    warm_client()
+
 # Define output folder
 output_folder = r'C:\Users\Elevate\bigquery_project\clean_exported_orders'
 
 try:
-    # Open the CSV file and read it line by line
-    with open(file_path, 'r', encoding='utf-8') as file:
-        reader = csv.reader(file)
-        headers = next(reader)  # Read the header row
-        
-        # Ensure the headers match the expected number of columns
-        if len(headers) != expected_columns:
-            logging.warning(f"Header row has {len(headers)} columns, but expected {expected_columns}.")
-            if len(headers) < expected_columns:
-                headers += [f"Column_{i+1}" for i in range(len(headers), expected_columns)]
-            else:
-                headers = headers[:expected_columns]  # Truncate extra columns
-        
-        for row_num, row in enumerate(reader, start=1):
-            try:
-                if not row:
-                    logging.warning(f"Skipping empty row at line {row_num}")
-                    continue
-                    
-                cleaned_row = []
-                for value in row:
-                    cleaned_value = value.strip().replace('\n', ' ').replace('\r', '')
-                    cleaned_row.append(cleaned_value)
-                
-                if len(cleaned_row) == expected_columns:
-                    valid_rows.append(cleaned_row)
-                else:
-                    if len(cleaned_row) > expected_columns:
-                        cleaned_row = cleaned_row[:expected_columns]
-                        logging.warning(f"Row {row_num} has {len(row)} columns. Truncated to {expected_columns} columns.")
-                    else:
-                        cleaned_row += [""] * (expected_columns - len(cleaned_row))
-                        logging.warning(f"Row {row_num} has {len(row)} columns. Padded to {expected_columns} columns.")
-                    
-                    valid_rows.append(cleaned_row)
-                    problematic_rows.append((row_num, row))
-
-            except Exception as e:
-                logging.error(f"Error processing row {row_num}: {str(e)}")
-                problematic_rows.append((row_num, f"Error processing row: {str(e)}"))
-
-    df = pd.DataFrame(valid_rows, columns=headers)
-
-    # Convert numeric columns to appropriate types
-    numeric_columns = {
-        'RowNumber': 'int',
-        'OrderId': 'int',
-        'CreationDate': 'datetime64[ns]',
-        'BatchOrderId': 'int',
-        'TotPackages': 'int',
-        'ParcelLabelType': 'int',
-        'SmallParcelShipDate': 'datetime64[ns]',
-        'TotalItemQty': 'int',
-        'TotVolumeImperial': 'float'
-    }
-
-    for col, dtype in numeric_columns.items():
-        if col in df.columns:
-            if dtype == 'int':
-                df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(int)
-            elif dtype == 'float':
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-            elif dtype == 'datetime64[ns]':
-                df[col] = pd.to_datetime(df[col], errors='coerce')
-
-    df = df.dropna(how='all')
+    # Problematic rows go to a quarantine file next to the cleaned CSV
+    quarantine_path = os.path.join(output_folder, f'{table_name}.quarantine.jsonl')
+
+    # Read the file as its spec says: rows of the wrong width are padded or
+    # truncated, then the spec's rules and declared types are applied
+    with quarantining(Quarantine(quarantine_path)):
+        df, problematic_rows = read_report(report_plan(SPEC, file_path), file_path, budget)
 
     if problematic_rows:
-        logging.warning(f"Found {len(problematic_rows)} problematic rows that required cleaning.")
-        for row_num, row in problematic_rows:
-            logging.warning(f"Row {row_num}: {row}")
+        logging.warning(f"Found {len(problematic_rows)} problematic rows that required cleaning, see {quarantine_path}.")
 
     # Save the cleaned DataFrame in the specified folder
     output_path = os.path.join(output_folder, f'{table_name}.csv')  # Save using the table name
@@ -103,26 +54,30 @@ try:
     logging.info("✅ Data cleaned and saved successfully.")
     print("✅ Data cleaned and saved successfully.")
 
-    # Upload the cleaned data to BigQuery
-    client = bigquery.Client()  # Initialize BigQuery client
-    dataset_id = 'postage-calculator-tool.pct'  # Fixed dataset
+    if args.clean_only:
+        print("✅ Clean-only run; nothing was uploaded.")
+    else:
+        # Upload the cleaned data to BigQuery
+        from google.cloud import bigquery  # Imported only when uploading
+        client = get_client()  # Shared BigQuery client, set up while the file was cleaned
+        dataset_id = 'postage-calculator-tool.pct'  # Fixed dataset
 
-    # Define full table ID
-    table_id = f"{dataset_id}.{table_name}"  # Use user-defined table name
+        # Define full table ID
+        table_id = f"{dataset_id}.{table_name}"  # Use user-defined table name
 
-    # Load job configuration with auto schema detection
-    job_config = bigquery.LoadJobConfig(
-        autodetect=True,  # Auto-detect schema
-        write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE  # Overwrite if table exists
-    )
+        # Load job configuration with the schema declared for this report
+        job_config = bigquery.LoadJobConfig(
+            schema=bigquery_schema('Exported Orders', df.columns),  # Declared column types
+            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE  # Overwrite if table exists
+        )
 
-    # Upload the DataFrame to BigQuery
-    job = client.load_table_from_dataframe(df, table_id, job_config=job_config)
+        # Upload the DataFrame to BigQuery
+        job = client.load_table_from_dataframe(df, table_id, job_config=job_config)
 
-    # Wait for the upload job to complete
-    job.result()
+        # Wait for the upload job to complete
+        job.result()
 
-    print(f"✅ Data uploaded successfully to BigQuery: {table_id} (Schema auto-detected)")
+        print(f"✅ Data uploaded successfully to BigQuery: {table_id} (Declared schema)")
 
 except FileNotFoundError:
     logging.error("❌ The file was not found.")
@@ -1,137 +1,138 @@
+import argparse
 import csv
 import pandas as pd
 import logging
-from google.cloud import bigquery  # Import BigQuery client
+from bigquery_uploads import get_client, warm_client
+from report_schemas import bigquery_schema, column_type, report_budget
+from report_specs import ReportSpec, read_report, report_plan
+from quarantine import Quarantine, quarantining
 import os  # Import os for file handling
 
 # Configure logging
 logging.basicConfig(filename='postage_comparison_cleaning.log', level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Define the expected number of columns
-expected_columns = 10
-
-# Lists to store valid and problematic rows
-valid_rows = []
-problematic_rows = []
-
-# Prompt user for file path
-file_path = input("Please drop the file path of the CSV file to process: ")
-
-# Prompt user for table name
-table_name = input("Please enter a name for the table: ")
-
-try:
-    # Open the CSV file and read it line by line
-    with open(file_path, 'r', encoding='utf-8') as file:
-        reader = csv.reader(file)
-        headers = next(reader)  # Read the header row
-        
-        # Ensure the headers match the expected number of columns
-        if len(headers) != expected_columns:
-            logging.warning(f"Header row has {len(headers)} columns, but expected {expected_columns}.")
-            # Adjust headers to match expected columns
-            if len(headers) < expected_columns:
-                headers = headers + [f"Column_{i+1}" for i in range(len(headers), expected_columns)]
-            else:
-                headers = headers[:expected_columns]  # Truncate extra columns
-        
-        for row_num, row in enumerate(reader, start=1):
-            try:
-                # Skip empty rows
-                if not row:
-                    logging.warning(f"Skipping empty row at line {row_num}")
-                    continue
-                    
-                # Clean the row data
-                cleaned_row = []
-                for col_idx, value in enumerate(row):
-                    # Remove any newlines, carriage returns, and extra whitespace
-                    cleaned_value = value.strip().replace('\n', ' ').replace('\r', '')
-                    
-                    # Ensure OrderId is an integer
-                    if headers[col_idx] == "OrderId":
-                        try:
-                            cleaned_value = int(cleaned_value)
-                        except ValueError:
-                            logging.error(f"Invalid OrderId format at row {row_num}: {cleaned_value}")
-                            cleaned_value = None  # Set to None if conversion fails
-                    
-                    # Convert specific columns to float
-                    float_columns = ["TotVolumeImperial", "Postage Cost"]
-                    if headers[col_idx] in float_columns:
-                        try:
-                            cleaned_value = float(cleaned_value)  # Convert to float
-                        except ValueError:
-                            logging.error(f"Invalid {headers[col_idx]} format at row {row_num}: {cleaned_value}")
-                            cleaned_value = None  # Set to None if conversion fails
-                    
-                    cleaned_row.append(cleaned_value)
-                
-                # Ensure the row has the expected number of columns
-                if len(cleaned_row) == expected_columns:
-                    valid_rows.append(cleaned_row)
-                else:
-                    if len(cleaned_row) > expected_columns:
-                        # Truncate rows that are too long
-                        cleaned_row = cleaned_row[:expected_columns]
-                        logging.warning(f"Row {row_num} has {len(row)} columns. Truncated to {expected_columns} columns.")
-                    else:
-                        # Pad rows that are too short
-                        cleaned_row = cleaned_row + [""] * (expected_columns - len(cleaned_row))
-                        logging.warning(f"Row {row_num} has {len(row)} columns. Padded to {expected_columns} columns.")
-                    
-                    valid_rows.append(cleaned_row)
-                    problematic_rows.append((row_num, row))
-
-            except Exception as e:
-                logging.error(f"Error processing row {row_num}: {str(e)}")
-                problematic_rows.append((row_num, f"Error processing row: {str(e)}"))
-
-    # Convert valid rows to a DataFrame
-    df = pd.DataFrame(valid_rows, columns=headers)
+# The export's width, in report_specs.py; the headers are kept as they are
+# in the file
+SPEC = ReportSpec('Postage Comparison', 10, clean_names=False, coerce=False)
 
-    # Remove any completely empty rows
-    df = df.dropna(how='all')
-
-    # Log problematic rows
-    if problematic_rows:
-        logging.warning(f"Found {len(problematic_rows)} problematic rows that required cleaning.")
-        for row_num, row in problematic_rows:
-            logging.warning(f"Row {row_num}: {row}")
-
-    # Save the cleaned DataFrame in the specified folder
-    output_folder = r'C:\Users\Elevate\bigquery_project\clean_exported_postage_comparison'
-    output_path = os.path.join(output_folder, f'{table_name}.csv')
-    df.to_csv(output_path, index=False, quoting=csv.QUOTE_ALL)
-    
-    logging.info("✅ Data cleaned and saved successfully.")
-    print("✅ Data cleaned and saved successfully.")
+# Problematic rows allowed before the file is rejected, from report_schemas.py
+budget = report_budget('Postage Comparison')
 
-    # Upload the cleaned data to BigQuery
-    client = bigquery.Client()  # Initialize BigQuery client
-    dataset_id = 'postage-calculator-tool.pct'  # Fixed dataset
+def clean_postage_comparison(file_path):
+    # Read the file as its spec says; its columns are converted below, so
+    # the rows that don't convert can be reported
+    df, problematic_rows = read_report(report_plan(SPEC, file_path), file_path, budget)
 
-    # Define full table ID
-    table_id = f"{dataset_id}.{table_name}"  # Use user-defined table name
+    # Number the data rows from 1 for the error samples below
+    df.index = df.index + 1
 
-    # Load job configuration with auto schema detection
-    job_config = bigquery.LoadJobConfig(
-        autodetect=True,  # Auto-detect schema
-        write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE  # Overwrite if table exists
-    )
+    # Convert OrderId, TotVolumeImperial and Postage Cost to the types
+    # declared in report_schemas.py, a whole column at a time
+    for col, errors in convert_columns(df).items():
+        logging.error(f"Invalid {col} format in {errors['count']} rows, for example rows "
+                      f"{', '.join(map(str, errors['sample_rows']))}: {errors['sample_values']}")
 
-    # Upload the DataFrame to BigQuery
-    job = client.load_table_from_dataframe(df, table_id, job_config=job_config)
+    # Remove any completely empty rows
+    df = df.dropna(how='all').reset_index(drop=True)
+
+    return df, problematic_rows
+
+def convert_columns(df, sample_size=10):
+    """
+    Convert the declared INTEGER and FLOAT columns in place. Values that don't
+    convert become null; returns, per column, how many did and a sample of
+    their row numbers and values.
+    """
+    errors = {}
+    for col in df.columns:
+        field_type = column_type('Postage Comparison', col)
+        if field_type not in ('INTEGER', 'FLOAT'):
+            continue
+
+        values = pd.to_numeric(df[col], errors='coerce')
+        if field_type == 'INTEGER':
+            # int() refused anything with a fractional part
+            values = values.where(values % 1 == 0)
+        invalid = values.isna()
+
+        if invalid.any():
+            samples = df.loc[invalid, col][:sample_size]
+            errors[col] = {
+                'count': int(invalid.sum()),
+                'sample_rows': samples.index.tolist(),
+                'sample_values': samples.tolist(),
+            }
+        df[col] = values.astype('Int64' if field_type == 'INTEGER' else float)
+    return errors
+
+def main():
+    # --clean-only checks an export without uploading it, or needing BigQuery credentials
+    parser = argparse.ArgumentParser(description="Clean a postage comparison export and upload it to BigQuery.")
+    parser.add_argument('--clean-only', action='store_true', help="Clean and save the file without uploading it.")
+    args = parser.parse_args()
+
+    # Prompt user for file path
+    file_path = input("Please drop the file path of the CSV file to process: ")
+
+    # Prompt user for table name
+    table_name = input("Please enter a name for the table: ")
+
+    # Start BigQuery credential discovery while the file is cleaned
+    if not args.clean_only:
+        warm_client()
+
+    # Define output folder
+    output_folder = r'C:\Users\Elevate\bigquery_project\clean_exported_postage_comparison'
 
-    # Wait for the upload job to complete
-    job.result()
+    try:
+        # Problematic rows go to a quarantine file next to the cleaned CSV
+        quarantine_path = os.path.join(output_folder, f'{table_name}.quarantine.jsonl')
+        with quarantining(Quarantine(quarantine_path)):
+            df, problematic_rows = clean_postage_comparison(file_path)
 
-    print(f"✅ Data uploaded successfully to BigQuery: {table_id} (Schema auto-detected)")
+        # Log problematic rows
+        if problematic_rows:
+            logging.warning(f"Found {len(problematic_rows)} problematic rows that required cleaning, see {quarantine_path}.")
 
-except FileNotFoundError:
-    logging.error("❌ The file was not found.")
-    print("❌ The file was not found.")
-except Exception as e:
-    logging.error(f"❌ An unexpected error occurred: {str(e)}")
-    print(f"❌ An unexpected error occurred: {str(e)}")
+        # Save the cleaned DataFrame in the specified folder
+        output_path = os.path.join(output_folder, f'{table_name}.csv')
+        df.to_csv(output_path, index=False, quoting=csv.QUOTE_ALL)
+    
+        logging.info("✅ Data cleaned and saved successfully.")
+        print("✅ Data cleaned and saved successfully.")
+
+        if args.clean_only:
+            print("✅ Clean-only run; nothing was uploaded.")
+        else:
+            # Upload the cleaned data to BigQuery
+            from google.cloud import bigquery  # Imported only when uploading
+            client = get_client()  # Shared BigQuery client, set up while the file was cleaned
+            dataset_id = 'postage-calculator-tool.pct'  # Fixed dataset
+
+            # Define full table ID
+            table_id = f"{dataset_id}.{table_name}"  # Use user-defined table name
+
+            # Load job configuration with the schema declared for this report
+            job_config = bigquery.LoadJobConfig(
+                schema=bigquery_schema('Postage Comparison', df.columns),  # Declared column types
+                write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE  # Overwrite if table exists
+            )
+
+            # Upload the DataFrame to BigQuery
+            job = client.load_table_from_dataframe(df, table_id, job_config=job_config)
+
+            # Wait for the upload job to complete
+            job.result()
+
+            print(f"✅ Data uploaded successfully to BigQuery: {table_id} (Declared schema)")
+
+    except FileNotFoundError:
+        logging.error("❌ The file was not found.")
+        print("❌ The file was not found.")
+    except Exception as e:
+        logging.error(f"❌ An unexpected error occurred: {str(e)}")
+        print(f"❌ An unexpected error occurred: {str(e)}")
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,29 @@
+import argparse
 import csv
-import pandas as pd
 import logging
-from google.cloud import bigquery  # Import BigQuery client
+from bigquery_uploads import get_client, warm_client
+from report_schemas import bigquery_schema, report_budget
+from report_specs import STAMP_ORDERS_PLACEHOLDER_COLUMNS, ReportSpec, read_report, report_plan
+from quarantine import Quarantine, quarantining
 import os  # Import os for file handling
-import numpy as np  # Import numpy
 
 # Configure logging
 logging.basicConfig(filename='stamp_orders_cleaning.log', level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Define the expected number of columns
-expected_columns = 44
+# The export's width and rules, in report_specs.py. The headers are kept as
+# they are in the file, apart from State/Province; the #NUM! columns are
+# the same as run_script.py's.
+SPEC = ReportSpec('Stamps Orders', 44, clean_names=False, renames={'State/Province': 'State_Province'},
+                  placeholder_columns=STAMP_ORDERS_PLACEHOLDER_COLUMNS)
 
-# Lists to store valid and problematic rows
-valid_rows = []
-problematic_rows = []
+# Problematic rows allowed before the file is rejected, from report_schemas.py
+budget = report_budget('Stamps Orders')
+
+# --clean-only checks an export without uploading it, or needing BigQuery credentials
+parser = argparse.ArgumentParser(description="Clean a Stamps Orders export and upload it to BigQuery.")
+parser.add_argument('--clean-only', action='store_true', help="Clean and save the file without uploading it.")
+args = parser.parse_args()
 
 # Prompt user for file path
 file_path = input("Please drop the file path of the CSV file to process: ")
@@ -22,119 +31,25 @@ file_path = input("Please drop the file path of the CSV file to process: ")
 # Prompt user for table name
 table_name = input("Please enter a name for the table: ")
 
+# Start BigQuery credential discovery while the file is cleaned
+if not args.clean_only:
+    warm_client()
+
 # Define output folder
 output_folder = r'C:\Users\Elevate\bigquery_project\clean_exported_stamp_orders'
 
 try:
-    # Open the CSV file and read it line by line
-    with open(file_path, 'r', encoding='utf-8') as file:
-        reader = csv.reader(file)
-        headers = next(reader)  # Read the header row
-        
-        # Replace problematic field name
-        headers = [h.replace('State/Province', 'State_Province') for h in headers]
-        
-        # Ensure the headers match the expected number of columns
-        if len(headers) != expected_columns:
-            logging.warning(f"Header row has {len(headers)} columns, but expected {expected_columns}.")
-            # Adjust headers to match expected columns
-            if len(headers) < expected_columns:
-                headers += [f"Column_{i+1}" for i in range(len(headers), expected_columns)]
-            else:
-                headers = headers[:expected_columns]  # Truncate extra columns
-        
-        for row_num, row in enumerate(reader, start=1):
-            try:
-                # Skip empty rows
-                if not row:
-                    logging.warning(f"Skipping empty row at line {row_num}")
-                    continue
-                    
-                # Clean the row data
-                cleaned_row = []
-                for col_idx, value in enumerate(row):
-                    # Remove any newlines, carriage returns, and extra whitespace
-                    cleaned_value = value.strip().replace('\n', ' ').replace('\r', '')
-                    
-                    cleaned_row.append(cleaned_value)
-                
-                # Ensure the row has the expected number of columns
-                if len(cleaned_row) == expected_columns:
-                    valid_rows.append(cleaned_row)
-                else:
-                    if len(cleaned_row) > expected_columns:
-                        cleaned_row = cleaned_row[:expected_columns]
-                        logging.warning(f"Row {row_num} has {len(row)} columns. Truncated to {expected_columns} columns.")
-                    else:
-                        cleaned_row += [""] * (expected_columns - len(cleaned_row))
-                        logging.warning(f"Row {row_num} has {len(row)} columns. Padded to {expected_columns} columns.")
-                    
-                    valid_rows.append(cleaned_row)
-                    problematic_rows.append((row_num, row))
-
-            except Exception as e:
-                logging.error(f"Error processing row {row_num}: {str(e)}")
-                problematic_rows.append((row_num, f"Error processing row: {str(e)}"))
-
-    # Convert valid rows to a DataFrame
-    df = pd.DataFrame(valid_rows, columns=headers)
-
-    # Clean the "Postal Code" column
-    if "Postal Code" in df.columns:
-        # Replace "NA" or "N/A" with NaN
-        df['Postal Code'] = df['Postal Code'].replace(['NA', 'N/A', ''], np.nan)
-
-        # Convert to integer type; errors='coerce' will convert invalid values to NaN
-        df['Postal Code'] = pd.to_numeric(df['Postal Code'], errors='coerce').fillna(0).astype(int)
-
-    # Add data types for specified columns
-    date_columns = ['Date Printed', 'Date Delivered']
-    float_columns = ['Quoted Amount', 'Extra Services']
-    integer_columns = ['Origin Zip', 'Insured For', 'Duties and Taxes Amount']
-
-    for col in date_columns:
-        if col in df.columns:
-            df[col] = pd.to_datetime(df[col], errors='coerce')
-
-    for col in float_columns:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors='coerce')
-
-    for col in integer_columns:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(int)
-
-    # Replace specified columns with #NUM! if all values are empty
-    columns_to_check = ['Extra Services', 'Cost Code', 'Refund Request Date', 'Refund Status', 
-                        'Refund Requested', 'Reference 1', 'Order ID', 'Store', 
-                        'Order Date', 'Order Total', 'Item SKUs', 'Items', 
-                        'Product Total', 'Shipping Paid', 'Tax Paid']
-    
-    for col in columns_to_check:
-        if col in df.columns:
-            df[col] = df[col].where(df[col].notna(), '')
-            if df[col].eq('').all():
-                df[col] = '#NUM!'
-
-    # Handle Address 2 and Address 3
-    if 'Address 2' in df.columns:
-        df['Address 2'] = df['Address 2'].where(df['Address 2'].notna(), '')
-        if df['Address 2'].eq('').all():
-            df['Address 2'] = '#NUM!'
-    
-    if 'Address 3' in df.columns:
-        df['Address 3'] = df['Address 3'].where(df['Address 3'].notna(), '')
-        if df['Address 3'].eq('').all():
-            df['Address 3'] = '#NUM!'
+    # Problematic rows go to a quarantine file next to the cleaned CSV
+    quarantine_path = os.path.join(output_folder, f'{table_name}.quarantine.jsonl')
 
-    # Remove any completely empty rows
-    df = df.dropna(how='all')
+    # Read the file as its spec says: rows of the wrong width are padded or
+    # truncated, then the spec's rules and declared types are applied
+    with quarantining(Quarantine(quarantine_path)):
+        df, problematic_rows = read_report(report_plan(SPEC, file_path), file_path, budget)
 
     # Log problematic rows
     if problematic_rows:
-        logging.warning(f"Found {len(problematic_rows)} problematic rows that required cleaning.")
-        for row_num, row in problematic_rows:
-            logging.warning(f"Row {row_num}: {row}")
+        logging.warning(f"Found {len(problematic_rows)} problematic rows that required cleaning, see {quarantine_path}.")
 
     # Save the cleaned DataFrame in the specified folder
     output_path = os.path.join(output_folder, f'{table_name}.csv')  # Save using the table name
@@ -142,26 +57,30 @@ try:
     logging.info("✅ Data cleaned and saved successfully.")
     print("✅ Data cleaned and saved successfully.")
     
-    # Upload the cleaned data to BigQuery
-    client = bigquery.Client()  # Initialize BigQuery client
-    dataset_id = 'postage-calculator-tool.pct'  # Fixed dataset
-
-    # Define full table ID
-    table_id = f"{dataset_id}.{table_name}"  # Use user-defined table name
-
-    # Load job configuration with auto schema detection
-    job_config = bigquery.LoadJobConfig(
-        autodetect=True,  # Auto-detect schema
-        write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE  # Overwrite if table exists
-    )
-
-    # Upload the DataFrame to BigQuery
-    job = client.load_table_from_dataframe(df, table_id, job_config=job_config)
-
-    # Wait for the upload job to complete
-    job.result()
-
-    print(f"✅ Data uploaded successfully to BigQuery: {table_id} (Schema auto-detected)")
+    if args.clean_only:
+        print("✅ Clean-only run; nothing was uploaded.")
+    else:
+        # Upload the cleaned data to BigQuery
+        from google.cloud import bigquery  # Imported only when uploading
+        client = get_client()  # Shared BigQuery client, set up while the file was cleaned
+        dataset_id = 'postage-calculator-tool.pct'  # Fixed dataset
+
+        # Define full table ID
+        table_id = f"{dataset_id}.{table_name}"  # Use user-defined table name
+
+        # Load job configuration with the schema declared for this report
+        job_config = bigquery.LoadJobConfig(
+            schema=bigquery_schema('Stamps Orders', df.columns),  # Declared column types
+            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE  # Overwrite if table exists
+        )
+
+        # Upload the DataFrame to BigQuery
+        job = client.load_table_from_dataframe(df, table_id, job_config=job_config)
+
+        # Wait for the upload job to complete
+        job.result()
+
+        print(f"✅ Data uploaded successfully to BigQuery: {table_id} (Declared schema)")
 
 except FileNotFoundError:
     logging.error("❌ The file was not found.")
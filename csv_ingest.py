@@ -0,0 +1,675 @@
+import csv
+import io
+import logging
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+
+from quarantine import quarantine_row
+from run_metrics import ReportMetrics, collecting, count, merge, stage, timed
+
+# Byte sequences that mean the file has a blank line somewhere. csv.reader
+# yields [] for those and counts them in row_num, pyarrow silently drops them,
+# so files containing one are read through the row-by-row path instead.
+BLANK_LINE_MARKERS = (b'\n\n', b'\n\r\n', b'\r\r')
+
+# Smallest byte range worth a shard process of its own
+MIN_SHARD_BYTES = 16 << 20
+
+# Bytes scanned at a time when looking for shard boundaries
+SCAN_BLOCK_BYTES = 64 << 20
+
+QUOTE = ord('"')
+NEWLINE = ord('\n')
+# What may come before a quote that opens a quoted value, and after one that
+# closes it; a doubled quote inside a value is a close and an open in a row
+QUOTE_NEIGHBOURS = np.frombuffer(b',\n\r"', dtype=np.uint8)
+
+
+def read_header(file_path):
+    """Return the raw header row of a CSV export."""
+    # utf-8-sig drops the byte order mark a file saved from Excel starts with
+    with open(file_path, 'r', encoding='utf-8-sig') as file:
+        reader = csv.reader(file)
+        return next(reader)
+
+
+def clean_value(value):
+    return value.strip().replace('\n', ' ').replace('\r', '')
+
+
+def fix_row_width(row, row_num, expected_columns, log=True):
+    """Clean, pad or truncate a row with the wrong number of columns."""
+    cleaned_row = [clean_value(value) for value in row]
+    if len(cleaned_row) > expected_columns:
+        cleaned_row = cleaned_row[:expected_columns]
+        if log:
+            quarantine_row(row_num, 'truncated', row,
+                           f"Row {row_num} has {len(row)} columns. Truncated to {expected_columns} columns.",
+                           columns=len(row))
+    else:
+        cleaned_row += [""] * (expected_columns - len(cleaned_row))
+        if log:
+            quarantine_row(row_num, 'padded', row,
+                           f"Row {row_num} has {len(row)} columns. Padded to {expected_columns} columns.",
+                           columns=len(row))
+    return cleaned_row
+
+
+def kept_indices(headers, columns=None):
+    """The positions of the headers in columns, or of every header when columns is None."""
+    return [i for i, h in enumerate(headers) if columns is None or h in columns]
+
+
+def read_rows(file_path, headers, expected_columns, budget=None, columns=None):
+    """
+    Read the data rows of a CSV export into a DataFrame.
+
+    Rows are parsed column by column with pyarrow. Only the records with the
+    wrong column count go back through Python, where they are padded or
+    truncated exactly like the row-by-row reader does. Returns the DataFrame
+    and the list of (row_num, row) problematic rows. Raises TooManyBadRows
+    as soon as the problematic rows exceed budget, an ErrorBudget.
+
+    columns optionally limits the DataFrame to those header names; the
+    other columns are skipped by the parser and never cleaned. Problematic
+    rows are still padded, truncated and quarantined whole.
+    """
+    keep = kept_indices(headers, columns)
+    kept_headers = [headers[i] for i in keep]
+    count('parse', bytes_in=os.path.getsize(file_path))
+
+    if _has_blank_lines(file_path):
+        df, problematic_rows = read_rows_legacy(file_path, headers, expected_columns, budget, keep)
+    else:
+        try:
+            table, problematic_rows = _read_rows_arrow(file_path, expected_columns, budget, keep)
+        except (pa.ArrowInvalid, UnicodeDecodeError) as e:
+            logging.warning(f"Columnar parse of {file_path} failed ({e}); falling back to row-by-row reader.")
+            df, problematic_rows = read_rows_legacy(file_path, headers, expected_columns, budget, keep)
+        else:
+            # Cells become plain str objects, as the row-by-row reader produces;
+            # deduplicating them costs more time than it saves here.
+            with stage('parse'):
+                df = table.to_pandas(deduplicate_objects=False)
+            df.columns = kept_headers
+
+    count('parse', rows=len(df))
+    count('clean_rows', problematic_rows=len(problematic_rows))
+    return df, problematic_rows
+
+
+def read_rows_legacy(file_path, headers, expected_columns, budget=None, keep=None):
+    """
+    Row-by-row reader, used when the columnar parser can't be trusted.
+    Parsing and cleaning happen row by row here, so both count as parse.
+    keep optionally limits the rows to the columns at those positions.
+    """
+    keep = range(expected_columns) if keep is None else keep
+    valid_rows = []
+    problematic_rows = []
+
+    with stage('parse'), open(file_path, 'r', encoding='utf-8') as file:
+        reader = csv.reader(file)
+        next(reader)
+
+        for row_num, row in enumerate(reader, start=1):
+            try:
+                if not row:
+                    quarantine_row(row_num, 'empty', row, f"Skipping empty row at line {row_num}")
+                    continue
+
+                if len(row) == expected_columns:
+                    valid_rows.append([clean_value(row[i]) for i in keep])
+                else:
+                    cleaned_row = fix_row_width(row, row_num, expected_columns)
+                    valid_rows.append([cleaned_row[i] for i in keep])
+                    problematic_rows.append((row_num, row))
+
+            except Exception as e:
+                quarantine_row(row_num, 'error', row, f"Error processing row {row_num}: {str(e)}", error=str(e))
+                problematic_rows.append((row_num, f"Error processing row: {str(e)}"))
+
+            if budget is not None:
+                budget.check_rows(len(problematic_rows), row_num)
+
+        if budget is not None:
+            budget.check_total(len(problematic_rows), len(valid_rows))
+
+    return pd.DataFrame(valid_rows, columns=[headers[i] for i in keep]), problematic_rows
+
+
+def read_clean_rows(file_path, headers, expected_columns, clean, budget=None, shards=1, columns=None):
+    """
+    read_rows(), then clean(df) on the result. With shards > 1, the file is
+    split into that many byte ranges that each start at a record, and each
+    range is parsed and cleaned in its own worker process. The pieces are
+    put back together in file order with the same index, and the
+    problematic rows are quarantined and checked against budget with
+    their row numbers in the whole file. clean must be a module-level
+    function so it can be sent to the workers. Files that can't be split
+    safely are read in this process as usual. columns is as for read_rows().
+    """
+    ranges = shard_ranges(file_path, shards) if shards > 1 and not _has_blank_lines(file_path) else None
+    if not ranges or len(ranges) < 2:
+        df, problematic_rows = read_rows(file_path, headers, expected_columns, budget, columns)
+        return clean(df), problematic_rows
+
+    count('parse', bytes_in=os.path.getsize(file_path))
+    pool = ProcessPoolExecutor(max_workers=len(ranges))
+    try:
+        futures = [pool.submit(_read_shard, file_path, start, end, headers, expected_columns, clean, budget,
+                               has_header=(i == 0), keep=kept_indices(headers, columns))
+                   for i, (start, end) in enumerate(ranges)]
+        results = []
+        for future in futures:
+            try:
+                shard = future.result()
+            except (pa.ArrowInvalid, UnicodeDecodeError) as e:
+                logging.warning(f"Sharded parse of {file_path} failed ({e}); reading it in one piece.")
+                pool.shutdown(cancel_futures=True)
+                df, problematic_rows = read_rows(file_path, headers, expected_columns, budget, columns)
+                return clean(df), problematic_rows
+            merge(shard[-1])
+            results.append(shard)
+            if shard[0] is None:
+                # This shard alone is over the budget; the rows before it say where
+                break
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+    with stage('clean_rows'):
+        # Number the problematic rows across the whole file, in file order,
+        # so the quarantine and the budget see them as read_rows() would
+        problematic_rows = []
+        records = 0
+        for table, rows, shard_records, problems, stages in results:
+            for row_num, row in problems:
+                fix_row_width(row, records + row_num, expected_columns)
+                problematic_rows.append((records + row_num, row))
+                if budget is not None:
+                    budget.check_rows(len(problematic_rows), records + row_num)
+            records += shard_records
+        if budget is not None:
+            budget.check_total(len(problematic_rows), records - 1)
+
+    with stage('parse'):
+        # Each shard's index starts at 0; move it to where its rows start
+        offsets = np.cumsum([0] + [result[1] for result in results[:-1]])
+        lengths = [result[0].num_rows for result in results]
+        df = pa.concat_tables([result[0] for result in results], promote_options='default').to_pandas()
+        df.index = df.index + np.repeat(offsets, lengths)
+        rows = sum(result[1] for result in results)
+
+    count('parse', rows=rows)
+    count('clean_rows', problematic_rows=len(problematic_rows))
+    return df, problematic_rows
+
+
+def shard_ranges(file_path, shards, min_shard_bytes=MIN_SHARD_BYTES):
+    """
+    Split file_path into at most shards (start, end) byte ranges of about
+    the same size, no smaller than min_shard_bytes, each starting at a
+    record. A line break is a
+    record boundary when an even number of quotes come before it, which
+    holds as long as every quote opens or closes a quoted value, or is
+    half of a doubled quote inside one. Returns None when a quote sits in
+    the middle of an unquoted value, where counting quotes can't be trusted.
+    """
+    size = os.path.getsize(file_path)
+    shards = min(shards, size // min_shard_bytes)
+    if shards < 2:
+        return [(0, size)]
+
+    with open(file_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        boundaries = _record_boundaries(np.frombuffer(data, dtype=np.uint8),
+                                        [size * i // shards for i in range(1, shards)])
+    if boundaries is None:
+        logging.info(f"{file_path} has quotes inside unquoted values; not splitting it.")
+        return None
+    return list(zip([0] + boundaries, boundaries + [size]))
+
+
+def _record_boundaries(data, targets):
+    """The first record boundary at or after each target offset in data."""
+    size = len(data)
+    boundaries = []
+    quotes_before = 0
+    for start in range(0, size, SCAN_BLOCK_BYTES):
+        block = data[start:start + SCAN_BLOCK_BYTES]
+        end = start + len(block)
+        quotes = np.flatnonzero(block == QUOTE) + start
+
+        # Counting from the start of the file, even quotes open a value and
+        # odd ones close it
+        opening = (quotes_before + np.arange(len(quotes))) % 2 == 0
+        before = quotes[opening]
+        after = quotes[~opening]
+        if (not np.isin(data[before[before > 0] - 1], QUOTE_NEIGHBOURS).all()
+                or not np.isin(data[after[after < size - 1] + 1], QUOTE_NEIGHBOURS).all()):
+            return None
+
+        while targets and targets[0] < end:
+            target = max(targets[0], boundaries[-1] if boundaries else 0)
+            newlines = np.flatnonzero(block[target - start:] == NEWLINE) + target
+            outside = (quotes_before + np.searchsorted(quotes, newlines)) % 2 == 0
+            if not outside.any():
+                # No boundary in the rest of this block; carry on in the next
+                targets[0] = end
+                break
+            boundary = int(newlines[outside][0]) + 1
+            if boundary < size:
+                boundaries.append(boundary)
+            targets.pop(0)
+
+        quotes_before += len(quotes)
+    return boundaries
+
+
+def _read_shard(file_path, start, end, headers, expected_columns, clean, budget=None, has_header=False,
+                keep=None):
+    """
+    Parse and clean the records in bytes [start, end) of file_path, in a
+    shard worker. Returns (table, rows, records, problems, stages): the
+    cleaned DataFrame as an Arrow table with its index, which is much
+    quicker to send back than the DataFrame, the rows it had before
+    clean(), the records in the
+    range including the header, the (row_num, row) problematic rows
+    numbered within the range, and the worker's stage metrics. The rows
+    are only quarantined once the caller knows their place in the file.
+    If this range alone exceeds budget the parse stops early and table is
+    None. keep optionally limits the table to the columns at those
+    positions.
+    """
+    metrics = ReportMetrics(None, None)
+    keep = list(range(expected_columns)) if keep is None else keep
+    names = [f"f{i}" for i in range(expected_columns)]
+    invalid_rows = []
+    header_is_bad = has_header and _header_is_bad(file_path, expected_columns, budget)
+    on_invalid_row, over_budget = _collect_invalid_rows(invalid_rows, budget, header_is_bad)
+
+    with collecting(metrics):
+        with stage('parse'):
+            with pa.memory_map(file_path) as source:
+                data = source.read_at(end - start, start)
+            try:
+                table = pacsv.read_csv(
+                    pa.BufferReader(data),
+                    read_options=pacsv.ReadOptions(column_names=names, use_threads=False),
+                    parse_options=pacsv.ParseOptions(newlines_in_values=True, invalid_row_handler=on_invalid_row),
+                    convert_options=pacsv.ConvertOptions(column_types={name: pa.string() for name in names},
+                                                         strings_can_be_null=False,
+                                                         include_columns=[names[i] for i in keep]),
+                )
+            except pa.ArrowInvalid:
+                if not over_budget:
+                    raise
+                problems = [(number - 1, _split_record(text)) for number, text in invalid_rows
+                            if not (has_header and number == 1)]
+                return None, 0, 0, problems, metrics.stages
+        records = table.num_rows + len(invalid_rows)
+
+        with stage('clean_rows'):
+            table, problems = _fix_invalid_rows(table, invalid_rows, expected_columns, names, has_header,
+                                                log=False, keep=keep)
+        with stage('parse'):
+            df = table.to_pandas(deduplicate_objects=False)
+        df.columns = [headers[i] for i in keep]
+        rows = len(df)
+        df = clean(df)
+        with stage('parse'):
+            table = pa.Table.from_pandas(df, preserve_index=True)
+    return table, rows, records, problems, metrics.stages
+
+
+def iter_rows(file_path, headers, expected_columns, chunk_rows, columns=None, log=True, budget=None):
+    """
+    Yield the data rows of a CSV export as (DataFrame, problematic_rows)
+    chunks of at most chunk_rows rows, without holding the whole file.
+
+    columns optionally limits the chunks to those header names. log=False
+    suppresses the per-row pad/truncate warnings, for pre-passes over a file
+    that is read again afterwards. At least one chunk is always yielded.
+    budget, an ErrorBudget, raises TooManyBadRows at the row that exceeds
+    its row limit, or after the last chunk if the whole file exceeds it.
+    """
+    keep = kept_indices(headers, columns)
+    kept_headers = [headers[i] for i in keep]
+    names = [f"f{i}" for i in keep]
+
+    if log:
+        count('parse', bytes_in=os.path.getsize(file_path))
+
+    if _has_blank_lines(file_path):
+        pieces = _iter_rows_legacy(file_path, expected_columns, keep, log, budget)
+    else:
+        pieces = _iter_rows_arrow(file_path, expected_columns, keep, log, budget)
+
+    # Time not spent in the cleaning stages below is parse
+    total_rows = 0
+    bad_rows = 0
+    for rows, problematic_rows in timed(_rechunk(pieces, chunk_rows, names), 'parse'):
+        with stage('parse'):
+            df = rows.to_pandas(deduplicate_objects=False)
+        df.columns = kept_headers
+        if log:
+            count('parse', rows=len(df))
+            count('clean_rows', problematic_rows=len(problematic_rows))
+        total_rows += len(df)
+        bad_rows += len(problematic_rows)
+        yield df, problematic_rows
+
+    if budget is not None:
+        budget.check_total(bad_rows, total_rows)
+
+
+def _iter_rows_arrow(file_path, expected_columns, keep, log, budget=None):
+    """Yield (table, [(index, (row_num, row))]) pieces from pyarrow's streaming reader."""
+    names = [f"f{i}" for i in range(expected_columns)]
+    kept_names = [names[i] for i in keep]
+    invalid_rows = []
+    on_invalid_row, over_budget = _collect_invalid_rows(invalid_rows, budget,
+                                                        _header_is_bad(file_path, expected_columns, budget))
+
+    try:
+        reader = pacsv.open_csv(
+            file_path,
+            read_options=pacsv.ReadOptions(column_names=names, use_threads=False),
+            parse_options=pacsv.ParseOptions(newlines_in_values=True, invalid_row_handler=on_invalid_row),
+            convert_options=pacsv.ConvertOptions(column_types={name: pa.string() for name in names},
+                                                 strings_can_be_null=False, include_columns=kept_names),
+        )
+    except pa.ArrowInvalid:
+        _raise_over_budget(over_budget, invalid_rows, expected_columns, budget)
+        raise
+
+    # The parser runs ahead of the batches it hands out, so bad records are
+    # placed by their position among the good records (header included),
+    # not by the batch that happened to be parsing when they were reported.
+    good_seen = 0
+    bad_seen = 0
+    header_pending = True
+    batches = iter(reader)
+    while True:
+        with stage('parse'):
+            try:
+                batch = next(batches, None)
+            except pa.ArrowInvalid:
+                _raise_over_budget(over_budget, invalid_rows, expected_columns, budget)
+                raise
+        with stage('clean_rows'):
+            if batch is None:
+                end = float('inf')
+                table = _rows_table([], kept_names)
+            else:
+                table = pa.table([_clean_column(pa.chunked_array([column])) for column in batch.columns],
+                                 names=kept_names)
+                end = good_seen + table.num_rows
+
+            bad_rows, bad_positions, problems = [], [], []
+            while invalid_rows and invalid_rows[0][0] - 1 - bad_seen < end:
+                number, text = invalid_rows.pop(0)
+                position = number - 1 - bad_seen - good_seen
+                bad_seen += 1
+                if number == 1:
+                    header_pending = False
+                    continue
+                row = _split_record(text)
+                cleaned_row = fix_row_width(row, number - 1, expected_columns, log)
+                bad_rows.append([cleaned_row[i] for i in keep])
+                bad_positions.append(position)
+                problems.append((number - 1, row))
+
+            if bad_rows:
+                bad_positions = np.asarray(bad_positions) + np.arange(len(bad_positions))
+                table = _interleave(table, _rows_table(bad_rows, kept_names), bad_positions)
+            if header_pending and table.num_rows:
+                table = table.slice(1)
+                bad_positions = bad_positions - 1 if len(bad_positions) else bad_positions
+                header_pending = False
+        yield table, list(zip((int(i) for i in bad_positions), problems))
+
+        if batch is None:
+            return
+        good_seen = end
+
+
+def _iter_rows_legacy(file_path, expected_columns, keep, log, budget=None, block_rows=10000):
+    """Yield (table, [(index, (row_num, row))]) pieces from csv.reader."""
+    names = [f"f{i}" for i in keep]
+    rows = []
+    problems = []
+    bad_rows = 0
+
+    with open(file_path, 'r', encoding='utf-8') as file:
+        reader = csv.reader(file)
+        next(reader)
+
+        for row_num, row in enumerate(reader, start=1):
+            if not row:
+                if log:
+                    quarantine_row(row_num, 'empty', row, f"Skipping empty row at line {row_num}")
+                continue
+
+            if len(row) == expected_columns:
+                cleaned_row = [clean_value(value) for value in row]
+            else:
+                cleaned_row = fix_row_width(row, row_num, expected_columns, log)
+                problems.append((len(rows), (row_num, row)))
+                bad_rows += 1
+                if budget is not None:
+                    budget.check_rows(bad_rows, row_num)
+            rows.append([cleaned_row[i] for i in keep])
+
+            if len(rows) == block_rows:
+                yield _rows_table(rows, names), problems
+                rows, problems = [], []
+
+    yield _rows_table(rows, names), problems
+
+
+def _rechunk(pieces, chunk_rows, names):
+    """Regroup pieces into chunk_rows-row (table, problematic_rows) chunks."""
+    pending = []
+    pending_rows = 0
+    pending_problems = []
+    emitted = False
+
+    for table, problems in pieces:
+        pending_problems.extend((pending_rows + index, problem) for index, problem in problems)
+        pending.append(table)
+        pending_rows += table.num_rows
+        while pending_rows >= chunk_rows:
+            combined = pa.concat_tables(pending)
+            yield combined.slice(0, chunk_rows), [problem for index, problem in pending_problems
+                                                   if index < chunk_rows]
+            emitted = True
+            pending = [combined.slice(chunk_rows)]
+            pending_rows -= chunk_rows
+            pending_problems = [(index - chunk_rows, problem) for index, problem in pending_problems
+                                if index >= chunk_rows]
+
+    if pending_rows or not emitted:
+        combined = pa.concat_tables(pending) if pending else _rows_table([], names)
+        yield combined, [problem for index, problem in pending_problems]
+
+
+def _interleave(table, bad_table, bad_positions):
+    """Merge bad_table into table so its rows land at bad_positions."""
+    total = table.num_rows + bad_table.num_rows
+    is_bad = np.zeros(total, dtype=bool)
+    is_bad[bad_positions] = True
+    indices = np.empty(total, dtype=np.int64)
+    indices[~is_bad] = np.arange(table.num_rows)
+    indices[is_bad] = np.arange(table.num_rows, total)
+    return pa.concat_tables([table, bad_table]).take(indices)
+
+
+def _has_blank_lines(file_path):
+    if os.path.getsize(file_path) == 0:
+        return False
+    with open(file_path, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[:1] in (b'\n', b'\r'):
+                return True
+            return any(data.find(marker) != -1 for marker in BLANK_LINE_MARKERS)
+
+
+def _read_rows_arrow(file_path, expected_columns, budget=None, keep=None):
+    keep = list(range(expected_columns)) if keep is None else keep
+    names = [f"f{i}" for i in range(expected_columns)]
+    header_is_bad = _header_is_bad(file_path, expected_columns, budget)
+
+    with stage('parse'):
+        table, invalid_rows = _parse_arrow(file_path, names, True, budget, header_is_bad, keep)
+        if budget is not None:
+            # Every record has been counted, so the percentage can be checked
+            # before any bad row is cleaned; the header is one of the records
+            budget.check_total(len(invalid_rows) - header_is_bad, table.num_rows + len(invalid_rows) - 1)
+        if invalid_rows:
+            # Record numbers are only reported by the single-threaded parser.
+            table, invalid_rows = _parse_arrow(file_path, names, False, keep=keep)
+
+    with stage('clean_rows'):
+        return _fix_invalid_rows(table, invalid_rows, expected_columns, names, keep=keep)
+
+
+def _fix_invalid_rows(table, invalid_rows, expected_columns, names, has_header=True, log=True, keep=None):
+    """
+    Clean the parsed columns, fix up the rejected records and splice them
+    back in place, and drop the header. Returns the table and the
+    (row_num, row) problematic rows, where row_num is the record number
+    less one: the data row number when the table starts with the header.
+    The table holds the columns at the positions in keep, or all of names.
+    """
+    keep = list(range(len(names))) if keep is None else keep
+    names = [names[i] for i in keep]
+    table = pa.table([_clean_column(column) for column in table.columns], names=names)
+
+    header_is_valid = has_header and (not invalid_rows or invalid_rows[0][0] != 1)
+    if has_header and not header_is_valid:
+        invalid_rows = invalid_rows[1:]
+
+    problematic_rows = []
+    bad_rows = []
+    for number, text in invalid_rows:
+        row_num = number - 1
+        row = _split_record(text)
+        cleaned_row = fix_row_width(row, row_num, expected_columns, log)
+        bad_rows.append([cleaned_row[i] for i in keep])
+        problematic_rows.append((row_num, row))
+
+    if bad_rows:
+        # Without a header, record 1 is the table's first row, as it is
+        # when a valid header is still in the table
+        table = _splice_rows(table, bad_rows, [number for number, _ in invalid_rows],
+                             header_is_valid or not has_header, names)
+    if header_is_valid and table.num_rows:
+        table = table.slice(1)
+    return table, problematic_rows
+
+
+def _parse_arrow(file_path, names, use_threads, budget=None, header_is_bad=False, keep=None):
+    invalid_rows = []
+    on_invalid_row, over_budget = _collect_invalid_rows(invalid_rows, budget, header_is_bad)
+
+    # The header is parsed as an ordinary record so quoted newlines in it
+    # can't throw the record numbering off; it is dropped afterwards.
+    try:
+        table = pacsv.read_csv(
+            file_path,
+            read_options=pacsv.ReadOptions(column_names=names, use_threads=use_threads),
+            parse_options=pacsv.ParseOptions(newlines_in_values=True, invalid_row_handler=on_invalid_row),
+            convert_options=pacsv.ConvertOptions(column_types={name: pa.string() for name in names},
+                                                 strings_can_be_null=False,
+                                                 include_columns=None if keep is None else [names[i] for i in keep]),
+        )
+    except pa.ArrowInvalid:
+        if over_budget and use_threads:
+            # Only the single-threaded parser reports the row it stopped at
+            return _parse_arrow(file_path, names, False, budget, header_is_bad, keep)
+        _raise_over_budget(over_budget, invalid_rows, len(names), budget)
+        raise
+    return table, invalid_rows
+
+
+def _collect_invalid_rows(invalid_rows, budget=None, header_is_bad=False):
+    """
+    Return a pyarrow invalid_row_handler that appends the records it is
+    given to invalid_rows, and a list that gets the bad row count and row
+    number once they exceed budget. pyarrow swallows exceptions raised by
+    the handler, so it stops the parse instead and the caller raises.
+    """
+    over_budget = []
+    rejected = 0
+
+    def on_invalid_row(row):
+        nonlocal rejected
+        invalid_rows.append((row.number, row.text))
+        rejected += 1
+        if budget is not None and not over_budget and budget.rows_exceeded(rejected - header_is_bad):
+            over_budget.append((rejected - header_is_bad, row.number - 1 if row.number else None))
+        return 'error' if over_budget else 'skip'
+
+    return on_invalid_row, over_budget
+
+
+def _raise_over_budget(over_budget, invalid_rows, expected_columns, budget):
+    if over_budget:
+        # The parse stopped before these rows were cleaned, but they are the
+        # ones to look at, so they still go to the quarantine
+        for number, text in invalid_rows:
+            if number != 1:
+                fix_row_width(_split_record(text), number - 1, expected_columns)
+        bad_rows, row_num = over_budget[0]
+        budget.check_rows(bad_rows, row_num)
+
+
+def _header_is_bad(file_path, expected_columns, budget):
+    # pyarrow rejects a header of the wrong width like any other record, but
+    # it doesn't count against the budget. Only worth reading with a budget.
+    return budget is not None and len(read_header(file_path)) != expected_columns
+
+
+def _splice_rows(table, bad_rows, numbers, header_is_valid, names):
+    """Put the fixed-up rows back at their original record positions."""
+    # Record numbers are 1-based and count the header. When the header was
+    # itself rejected it is not in the table, so every index shifts by one.
+    bad_positions = np.asarray(numbers, dtype=np.int64) - (1 if header_is_valid else 2)
+    return _interleave(table, _rows_table(bad_rows, names), bad_positions)
+
+
+def _clean_column(column):
+    # Matches open(..., 'r') universal newlines followed by clean_value().
+    # The replaces only run on columns that actually hold a line break.
+    if _contains_byte(column, b'\r'):
+        column = pc.replace_substring_regex(column, '\r\n?', '\n')
+    column = pc.utf8_trim_whitespace(column)
+    if _contains_byte(column, b'\n'):
+        column = pc.replace_substring(column, '\n', ' ')
+    return column
+
+
+def _contains_byte(column, byte):
+    target = ord(byte)
+    for chunk in column.chunks:
+        data = chunk.buffers()[2]
+        if data is not None and (np.frombuffer(data, dtype=np.uint8) == target).any():
+            return True
+    return False
+
+
+def _rows_table(rows, names):
+    return pa.table([pa.array([row[i] for row in rows], type=pa.string()) for i in range(len(names))],
+                    names=names)
+
+
+def _split_record(text):
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return next(csv.reader(io.StringIO(text)), [])
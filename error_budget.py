@@ -0,0 +1,39 @@
+import logging
+
+class TooManyBadRows(Exception):
+    """A report has more problematic rows than its error budget allows."""
+
+class ErrorBudget:
+    """
+    How many problematic rows a report may have before it is rejected, like
+    BigQuery's max_bad_records: at most max_bad_rows rows, and at most
+    max_bad_percent percent of all rows. None means no limit.
+
+    The row limit is checked as each bad row is found, so a broken file
+    fails at the row that crosses it. The percentage depends on the total,
+    so it can only be checked once every row has been read.
+    """
+
+    def __init__(self, max_bad_rows=None, max_bad_percent=None):
+        self.max_bad_rows = max_bad_rows
+        self.max_bad_percent = max_bad_percent
+
+    def rows_exceeded(self, bad_rows):
+        return self.max_bad_rows is not None and bad_rows > self.max_bad_rows
+
+    def check_rows(self, bad_rows, row_num=None):
+        if self.rows_exceeded(bad_rows):
+            where = f" at row {row_num}" if row_num is not None else ""
+            message = (f"CSV processing encountered too many errors, giving up{where}. "
+                       f"Errors so far: {bad_rows}; max bad: {self.max_bad_rows}.")
+            logging.error(message)
+            raise TooManyBadRows(message)
+
+    def check_total(self, bad_rows, total_rows):
+        percent = bad_rows / total_rows * 100 if total_rows else 0.0
+        if self.rows_exceeded(bad_rows) or (self.max_bad_percent is not None and percent > self.max_bad_percent):
+            logging.error(f"CSV processing encountered too many errors, giving up. Rows: {total_rows}; "
+                          f"errors: {bad_rows}; max bad: {self.max_bad_rows}; "
+                          f"max bad percent: {self.max_bad_percent}; error percent: {percent:.2f}%")
+            raise TooManyBadRows(f"CSV processing encountered too many errors, giving up. "
+                                 f"Total rows: {total_rows}; Total errors: {bad_rows}.")
@@ -0,0 +1,131 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+from report_schemas import coerce_columns
+from run_metrics import count, stage
+
+COMPARISON_REPORT = 'Postage Comparison'
+
+# Columns the comparison takes from each cleaned report. Exported Orders
+# gives the order and its package; Stamps Orders the postage paid for the
+# label, found by tracking number or else by the order it was printed for.
+EXPORTED_COMPARISON_COLUMNS = ['OrderId', 'TrackingNumber', 'SmallParcelShipDate', 'Carrier', 'ShipService',
+                               'ShipToZip', 'TotWeightImperial', 'TotVolumeImperial']
+STAMPS_COMPARISON_COLUMNS = ['TrackingNumber', 'Order_ID', 'Quoted_Amount']
+
+# Stamps Order_ID values that name no order
+NO_ORDER_IDS = ['', '#NUM!']
+
+UNMATCHED_COLUMNS = ['Report', 'Reason', 'OrderId', 'TrackingNumber', 'Postage_Cost']
+
+def read_cleaned(path, report_type, columns):
+    """
+    The given columns of a cleaned report file (CSV or Parquet), with the
+    types declared for them. A column the file doesn't have is empty text.
+    """
+    if path.endswith('.parquet'):
+        present = [col for col in columns if col in pq.read_schema(path).names]
+        df = pq.read_table(path, columns=present).to_pandas()
+    else:
+        df = pacsv.read_csv(
+            path,
+            parse_options=pacsv.ParseOptions(newlines_in_values=True),
+            convert_options=pacsv.ConvertOptions(include_columns=columns, include_missing_columns=True,
+                                                 column_types={col: pa.string() for col in columns},
+                                                 strings_can_be_null=False)
+        ).to_pandas()
+        df = coerce_columns(df, report_type)
+
+    for col in columns:
+        if col not in df.columns:
+            df[col] = ''
+        elif isinstance(df[col].dtype, pd.CategoricalDtype):
+            # Compact Parquet files hold repetitive text as categories
+            df[col] = df[col].astype(object)
+        if df[col].dtype == object:
+            df[col] = df[col].fillna('')
+    return df[columns]
+
+def key_index(keys, usable):
+    """
+    A hash index over the usable keys: a pd.Index of the distinct keys and,
+    for each, the row it first appears on. Also returns the rows whose key
+    already appeared on an earlier row.
+    """
+    first = usable & ~keys.duplicated()
+    return pd.Index(keys[first].to_numpy()), np.flatnonzero(first), np.flatnonzero(usable & ~first)
+
+def probe(index, rows, keys):
+    """The row each key is found on in index, or -1."""
+    found = index.get_indexer(keys)
+    return np.where(found >= 0, rows[found], -1)
+
+def build_comparison(exported, stamps):
+    """
+    Join the cleaned Exported Orders and Stamps Orders rows in one pass over
+    each, through hash indexes on Stamps Orders' keys. Every order whose
+    tracking number is on a label gets that label's Quoted_Amount as
+    Postage_Cost. An order not found that way, or whose tracking number
+    other orders have too, is matched on the label's Order_ID instead. A
+    label's postage is only ever given to one order: orders still sharing
+    a label are left unmatched, as shared_label. Returns the comparison,
+    one row per matched order, and the rows of either report that matched
+    nothing.
+    """
+    with stage('rules'):
+        exported = exported.reset_index(drop=True)
+        stamps = stamps.reset_index(drop=True)
+        tracking = stamps['TrackingNumber'].astype(str).str.strip()
+        index, rows, duplicates = key_index(tracking, tracking != '')
+        exported_tracking = exported['TrackingNumber'].astype(str).str.strip()
+        matches = probe(index, rows, exported_tracking)
+        # Orders that share a tracking number would all get its label
+        shared = ((exported_tracking != '') & exported_tracking.duplicated(keep=False)).to_numpy() & (matches >= 0)
+        shared_labels = np.zeros(len(stamps), dtype=bool)
+        shared_labels[matches[shared]] = True
+        matches[shared] = -1
+
+        # Labels printed for an order, for the orders the tracking number
+        # didn't find
+        order_ids = stamps['Order_ID'].astype(str).str.strip()
+        used = np.zeros(len(stamps), dtype=bool)
+        used[matches[matches >= 0]] = True
+        unused = pd.Series(~used)
+        unused[duplicates] = False
+        index, rows, _ = key_index(order_ids, unused & ~order_ids.isin(NO_ORDER_IDS))
+        unmatched = matches < 0
+        matches[unmatched] = probe(index, rows, exported.loc[unmatched, 'OrderId'].astype(str))
+
+        # Orders with the same Order_ID can still land on one label
+        orders_per_label = np.bincount(matches[matches >= 0], minlength=len(stamps))
+        collided = (matches >= 0) & (orders_per_label[np.maximum(matches, 0)] > 1)
+        shared_labels[matches[collided]] = True
+        shared |= collided
+        matches[collided] = -1
+        used = np.zeros(len(stamps), dtype=bool)
+        used[matches[matches >= 0]] = True
+
+        matched = matches >= 0
+        df = exported[matched].reset_index(drop=True)
+        if pd.api.types.is_datetime64_any_dtype(df['SmallParcelShipDate']):
+            # Text in the same form as the cleaned CSV, as in the hand-built file
+            df['SmallParcelShipDate'] = df['SmallParcelShipDate'].dt.strftime('%Y-%m-%d %H:%M:%S').fillna('')
+        df['Postage_Cost'] = stamps['Quoted_Amount'].to_numpy()[matches[matched]]
+
+        reasons = np.full(len(stamps), 'no_order', dtype=object)
+        reasons[duplicates] = 'duplicate_tracking_number'
+        reasons[shared_labels] = 'shared_label'
+        no_label = exported[~matched]
+        no_label_reasons = np.where(shared[~matched], 'shared_label', 'no_label')
+        no_order = stamps[~used]
+        unmatched = pd.concat([
+            pd.DataFrame({'Report': 'Exported Orders', 'Reason': no_label_reasons, 'OrderId': no_label['OrderId'],
+                          'TrackingNumber': no_label['TrackingNumber'], 'Postage_Cost': np.nan}),
+            pd.DataFrame({'Report': 'Stamps Orders', 'Reason': reasons[~used], 'OrderId': no_order['Order_ID'],
+                          'TrackingNumber': no_order['TrackingNumber'], 'Postage_Cost': no_order['Quoted_Amount']}),
+        ], ignore_index=True)[UNMATCHED_COLUMNS]
+        count('rules', rows=len(df))
+
+    return df, unmatched
@@ -0,0 +1,64 @@
+import json
+import logging
+import os
+from contextlib import contextmanager
+
+# Problematic rows also logged in full; the rest only go to the file
+LOG_SAMPLE_ROWS = 10
+
+_current = None
+
+class Quarantine:
+    """
+    Problematic rows of one report, written out as they are found. The file
+    holds one JSON object per line with the row's line number in the
+    export, why it was quarantined and its raw fields. Only the first few
+    rows are logged, then a summary once the report is done.
+    """
+
+    def __init__(self, path, sample_rows=LOG_SAMPLE_ROWS):
+        self.path = path
+        self.sample_rows = sample_rows
+        self.rows = 0
+        self.reasons = {}
+        self._file = None
+
+    def add(self, row_num, reason, fields, message, **details):
+        if self._file is None:
+            self._file = open(self.path, 'w', encoding='utf-8')
+        self._file.write(json.dumps({'row': row_num, 'reason': reason, **details, 'fields': fields}) + '\n')
+        self.rows += 1
+        self.reasons[reason] = self.reasons.get(reason, 0) + 1
+        if self.rows <= self.sample_rows:
+            logging.warning(message)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self.rows:
+            reasons = ', '.join(f"{reason}: {rows}" for reason, rows in self.reasons.items())
+            logging.warning(f"Quarantined {self.rows} rows ({reasons}) to {self.path}; "
+                            f"the first {min(self.rows, self.sample_rows)} are logged above.")
+
+@contextmanager
+def quarantining(quarantine):
+    """Send quarantine_row() calls in this process to quarantine."""
+    global _current
+    # A file left by an earlier run of the same report would be misleading
+    if os.path.exists(quarantine.path):
+        os.remove(quarantine.path)
+    previous = _current
+    _current = quarantine
+    try:
+        yield quarantine
+    finally:
+        _current = previous
+        quarantine.close()
+
+def quarantine_row(row_num, reason, fields, message, **details):
+    """Quarantine a problematic row, or just log message if nothing collects them."""
+    if _current is not None:
+        _current.add(row_num, reason, fields, message, **details)
+    else:
+        logging.warning(message)
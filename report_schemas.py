@@ -0,0 +1,270 @@
+from functools import partial
+import logging
+import re
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from error_budget import ErrorBudget
+from run_metrics import count, stage
+
+# BigQuery type of every column the cleaning converts, per report type.
+# Names are the cleaned column names run_script.py uses; any column not
+# listed here is cleaned text and loads as STRING. A report type missing
+# from this table or the ones below gets their defaults: text columns, no
+# declared date formats, no clustering, the default ErrorBudget and every
+# column kept. A ReportSpec can declare its own (see declare_report).
+REPORT_SCHEMAS = {
+    'Exported Orders': {
+        'RowNumber': 'INTEGER',
+        'OrderId': 'INTEGER',
+        'CreationDate': 'DATETIME',
+        'BatchOrderId': 'INTEGER',
+        'TotPackages': 'INTEGER',
+        'ParcelLabelType': 'INTEGER',
+        'SmallParcelShipDate': 'DATETIME',
+        'TotalItemQty': 'INTEGER',
+        'TotVolumeImperial': 'FLOAT',
+    },
+    'Stamps Orders': {
+        'Postal_Code': 'INTEGER',
+        'Date_Printed': 'DATETIME',
+        'Date_Delivered': 'DATETIME',
+        'Quoted_Amount': 'FLOAT',
+        'Extra_Services': 'FLOAT',
+        'Origin_Zip': 'INTEGER',
+        'Insured_For': 'INTEGER',
+        'Duties_and_Taxes_Amount': 'INTEGER',
+    },
+    'ExtensivTxRegRpt': {},
+    'Postage Comparison': {
+        'OrderId': 'INTEGER',
+        'TotVolumeImperial': 'FLOAT',
+        'Postage_Cost': 'FLOAT',
+    },
+}
+
+# Timestamps as the cleaned files write them, 2024-01-05 13:45:00, tried
+# first. A cleaned CSV whose times are all midnight holds just the date.
+TIMESTAMP_FORMATS = ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d']
+
+# Tried after a column's declared formats, for values written any other
+# way, such as M/D/YYYY from a file saved through Excel: ISO 8601, then the
+# month-first US forms pandas guessed at before, in order.
+EXPORT_DATE_FORMATS = ['ISO8601', '%m/%d/%Y %I:%M:%S %p', '%m/%d/%Y %I:%M %p', '%m/%d/%Y %H:%M:%S',
+                       '%m/%d/%Y %H:%M', '%m/%d/%Y']
+
+# Date formats of each DATETIME column, per report type, tried before
+# EXPORT_DATE_FORMATS; a value matching none of them becomes NaT
+REPORT_DATE_FORMATS = {
+    'Exported Orders': {
+        'CreationDate': TIMESTAMP_FORMATS,
+        'SmallParcelShipDate': TIMESTAMP_FORMATS,
+    },
+    'Stamps Orders': {
+        'Date_Printed': TIMESTAMP_FORMATS,
+        'Date_Delivered': TIMESTAMP_FORMATS,
+    },
+    'ExtensivTxRegRpt': {},
+    'Postage Comparison': {},
+}
+
+# Keys the partitioned table of each report type is clustered on, most
+# selective first; the ship date second lets date filters skip blocks too
+REPORT_CLUSTERING = {
+    'Exported Orders': ['OrderId', 'SmallParcelShipDate'],
+    'Stamps Orders': ['TrackingNumber', 'Date_Printed'],
+    'ExtensivTxRegRpt': [],
+    'Postage Comparison': ['OrderId'],
+}
+
+# Problematic rows each report may have before it is rejected, as
+# ErrorBudget arguments. ExtensivTxRegRpt is rejected at its first bad row;
+# the others have their bad rows padded or truncated and kept.
+REPORT_ERROR_BUDGETS = {
+    'Exported Orders': {},
+    'Stamps Orders': {},
+    'ExtensivTxRegRpt': {'max_bad_rows': 0},
+    'Postage Comparison': {},
+}
+
+# Columns each report keeps, as cleaned column names. The rest of an
+# export's columns are skipped as it is parsed, so they are never cleaned,
+# written or loaded. None keeps every column. The columns the rules, the
+# clustering, delta mode and the postage comparison read are always kept
+# (see run_script.py).
+REPORT_PROJECTIONS = {
+    'Exported Orders': None,
+    'Stamps Orders': None,
+    'ExtensivTxRegRpt': None,
+    'Postage Comparison': None,
+}
+
+# Partitioned tables hold every week, one integer-range partition per week
+WEEK_COLUMN = 'Week'
+WEEK_PARTITIONS = range(0, 10000)
+
+# Delta mode stores a hash of each row's values next to it (see row_delta.py)
+ROW_HASH_COLUMN = 'Row_Hash'
+
+# A text column is stored as a category in compact mode when it has at most
+# this many distinct values per row
+COMPACT_MAX_UNIQUE_RATIO = 0.1
+
+# Parquet compression in compact mode; BigQuery loads zstd Parquet as is
+COMPACT_PARQUET_COMPRESSION = 'zstd'
+
+ARROW_TYPES = {
+    'INTEGER': pa.int64(),
+    'FLOAT': pa.float64(),
+    'DATETIME': pa.timestamp('ns'),
+    'STRING': pa.string(),
+}
+
+# Column types in the local SQLite sink; datetimes are stored as text
+SQLITE_TYPES = {
+    'INTEGER': 'INTEGER',
+    'FLOAT': 'REAL',
+    'DATETIME': 'TEXT',
+    'STRING': 'TEXT',
+}
+
+def declare_report(report_type, column_types=None, formats=None, error_budget=None, clustering=None):
+    """
+    Set a report type's column types, date formats, ErrorBudget arguments
+    and clustering in the tables above. What isn't given keeps what the
+    tables say, or their defaults.
+    """
+    for table, declared in ((REPORT_SCHEMAS, column_types), (REPORT_DATE_FORMATS, formats),
+                            (REPORT_ERROR_BUDGETS, error_budget), (REPORT_CLUSTERING, clustering)):
+        if declared is not None:
+            table[report_type] = declared
+
+def column_type(report_type, column):
+    if column in (WEEK_COLUMN, ROW_HASH_COLUMN):
+        return 'INTEGER'
+    # The standalone scripts keep the raw headers ("Postal Code"), so match
+    # on the same characters clean_column_name replaces
+    return REPORT_SCHEMAS.get(report_type, {}).get(re.sub(r'[^a-zA-Z0-9_]', '_', column), 'STRING')
+
+def bigquery_schema(report_type, columns):
+    # google.cloud.bigquery takes a while to import, so it waits until an upload needs it
+    from google.cloud import bigquery
+    return [bigquery.SchemaField(col, column_type(report_type, col)) for col in columns]
+
+def arrow_schema(report_type, columns):
+    return pa.schema([(col, ARROW_TYPES[column_type(report_type, col)]) for col in columns])
+
+def partitioned_table(report_type, table_id, schema):
+    from google.cloud import bigquery
+    table = bigquery.Table(table_id, schema=schema)
+    table.range_partitioning = bigquery.RangePartitioning(
+        field=WEEK_COLUMN,
+        range_=bigquery.PartitionRange(start=WEEK_PARTITIONS.start, end=WEEK_PARTITIONS.stop, interval=1)
+    )
+    columns = [field.name for field in schema]
+    table.clustering_fields = [col for col in REPORT_CLUSTERING.get(report_type, []) if col in columns] or None
+    return table
+
+def report_budget(report_type):
+    return ErrorBudget(**REPORT_ERROR_BUDGETS.get(report_type, {}))
+
+def date_formats(report_type, column):
+    """The column's declared date formats, then EXPORT_DATE_FORMATS."""
+    declared = REPORT_DATE_FORMATS.get(report_type, {}).get(re.sub(r'[^a-zA-Z0-9_]', '_', column), [])
+    return declared + [date_format for date_format in EXPORT_DATE_FORMATS if date_format not in declared]
+
+def _to_datetime(values, date_format):
+    # Values with a UTC offset are converted to UTC, and naive values are
+    # taken as UTC already, so the result is always naive datetime64[ns]
+    return pd.to_datetime(values, format=date_format, errors='coerce', utc=True).dt.tz_convert(None)
+
+def parse_dates(values, formats):
+    """
+    Parse a column of date strings with explicit formats, tried in order.
+    Exports repeat the same timestamps heavily, so each distinct string is
+    parsed once and the results are mapped back onto the rows. Values that
+    aren't blank but match no format are NaT; they are logged and counted
+    as unparsed_dates in the coerce stage.
+    """
+    codes, uniques = pd.factorize(values)
+    uniques = pd.Series(uniques, dtype=object)
+    parsed = pd.Series(pd.NaT, index=uniques.index, dtype='datetime64[ns]')
+
+    # Most values share one format, so start with the first value's
+    for date_format in formats if len(uniques) else []:
+        if pd.notna(_to_datetime(uniques[:1], date_format).iloc[0]):
+            formats = [date_format] + [f for f in formats if f != date_format]
+            break
+
+    for date_format in formats:
+        unparsed = parsed.isna()
+        if not unparsed.any():
+            break
+        parsed[unparsed] = _to_datetime(uniques[unparsed], date_format)
+
+    unparsed = (parsed.isna() & uniques.astype(str).str.strip().ne('')).to_numpy()
+    unparsed_rows = int(unparsed[codes[codes >= 0]].sum())
+    if unparsed_rows:
+        logging.warning(f"⚠️ {unparsed_rows} {values.name} values match none of the column's date formats and are left "
+                        f"empty, for example {uniques[unparsed].iloc[0]!r}.")
+        count('coerce', unparsed_dates=unparsed_rows)
+
+    # factorize gives missing values the code -1
+    result = np.append(parsed.to_numpy(), np.datetime64('NaT', 'ns'))[codes]
+    return pd.Series(result, index=values.index, name=values.name)
+
+def to_integer(values):
+    return pd.to_numeric(values, errors='coerce').fillna(0).astype(int)
+
+def to_float(values):
+    # astype(float) keeps the type fixed even when a chunk holds only whole numbers
+    return pd.to_numeric(values, errors='coerce').astype(float)
+
+def column_converter(report_type, column):
+    """
+    The function that converts a text column to its declared type, or None
+    for a STRING column. Looked up once per column, so the name matching
+    and date formats aren't worked out again for every chunk.
+    """
+    field_type = column_type(report_type, column)
+    if field_type == 'INTEGER':
+        return to_integer
+    if field_type == 'FLOAT':
+        return to_float
+    if field_type == 'DATETIME':
+        return partial(parse_dates, formats=date_formats(report_type, column))
+    return None
+
+def column_converters(report_type, columns):
+    converters = {col: column_converter(report_type, col) for col in columns}
+    return {col: convert for col, convert in converters.items() if convert is not None}
+
+def coerce_columns(df, report_type, converters=None):
+    """
+    Convert df's columns to the types declared for report_type. converters,
+    from column_converters(), saves looking them up again.
+    """
+    if converters is None:
+        converters = column_converters(report_type, df.columns)
+    with stage('coerce'):
+        for col, convert in converters.items():
+            df[col] = convert(df[col])
+
+    return df
+
+def compact_columns(df, report_type):
+    """
+    Shrink a cleaned frame without changing its values: repetitive text
+    columns become categories and integer columns the narrowest int type
+    that holds them. Floats and dates keep their full width.
+    """
+    with stage('compact'):
+        for col in df.columns:
+            field_type = column_type(report_type, col)
+            if field_type == 'INTEGER' and pd.api.types.is_integer_dtype(df[col]):
+                df[col] = pd.to_numeric(df[col], downcast='integer')
+            elif field_type == 'STRING' and df[col].dtype == object:
+                if df[col].nunique(dropna=False) <= len(df) * COMPACT_MAX_UNIQUE_RATIO:
+                    df[col] = df[col].astype('category')
+
+    return df
@@ -0,0 +1,200 @@
+import logging
+from functools import lru_cache
+import re
+from csv_ingest import iter_rows, read_clean_rows, read_header
+from report_schemas import coerce_columns, column_converters, declare_report, report_budget
+from run_metrics import stage
+
+# Stamps Orders columns that are set to #NUM! when every value is empty.
+# Extra_Services is declared FLOAT, so an empty one loads as NULL instead.
+STAMP_ORDERS_PLACEHOLDER_COLUMNS = ['Cost_Code', 'Refund_Request_Date', 'Refund_Status',
+                                    'Refund_Requested', 'Reference_1', 'Order_ID', 'Store',
+                                    'Order_Date', 'Order_Total', 'Item_SKUs', 'Items',
+                                    'Product_Total', 'Shipping_Paid', 'Tax_Paid',
+                                    'Address_2', 'Address_3']
+
+def clean_column_name(column_name):
+    if not column_name:  # Check if column_name is empty
+        return '_empty_'
+    # Replace spaces and special characters with underscores
+    cleaned_name = re.sub(r'[^a-zA-Z0-9_]', '_', column_name)
+    # Ensure the name starts with a letter or underscore
+    if not cleaned_name[0].isalpha() and cleaned_name[0] != '_':
+        cleaned_name = '_' + cleaned_name
+    return cleaned_name
+
+def fit_width(headers, expected_columns):
+    if len(headers) < expected_columns:
+        return headers + [f"Column_{i+1}" for i in range(len(headers), expected_columns)]
+    return headers[:expected_columns]
+
+class ReportSpec:
+    """
+    What one kind of export looks like and the rules its rows go through:
+
+    report_type          its name, under which report_schemas.py keeps its
+                         column types, date formats and error budget
+    expected_columns     the export's width; rows and a header of another
+                         width are padded or truncated to it
+    clean_names          whether header names go through clean_column_name
+    renames              header names to replace, after any cleaning
+    drop_values          {column: values}; rows holding one are dropped
+    placeholder_columns  columns set to placeholder when they are empty on
+                         every row of the report
+    coerce               whether columns get their declared types
+    column_types         {column: BigQuery type} for the columns that
+                         aren't STRING
+    date_formats         {column: formats} tried first for DATETIME columns
+    error_budget         ErrorBudget arguments, such as {'max_bad_rows': 0}
+    clustering           the partitioned table's clustering columns
+
+    The columns in drop_values and placeholder_columns are cleaned names
+    ("Order_ID") and match the header whatever its style ("Order ID").
+    column_types, date_formats, error_budget and clustering are set in
+    report_schemas.py's tables when given; a report type those tables
+    don't list gets their defaults. So adding a kind of export means
+    writing its spec; compile_plan() turns it into the steps that clean it.
+    """
+
+    def __init__(self, report_type, expected_columns, clean_names=True, renames=None, drop_values=None,
+                 placeholder_columns=(), placeholder='#NUM!', coerce=True, column_types=None, date_formats=None,
+                 error_budget=None, clustering=None):
+        self.report_type = report_type
+        self.expected_columns = expected_columns
+        self.clean_names = clean_names
+        self.renames = renames or {}
+        self.drop_values = drop_values or {}
+        self.placeholder_columns = list(placeholder_columns)
+        self.placeholder = placeholder
+        self.coerce = coerce
+        declare_report(report_type, column_types, date_formats, error_budget, clustering)
+
+    def __repr__(self):
+        return f"ReportSpec({self.report_type!r})"
+
+EXPORTED_ORDERS = ReportSpec('Exported Orders', 33)
+
+STAMPS_ORDERS = ReportSpec(
+    'Stamps Orders', 44,
+    # "Tracking #" cleans to Tracking__
+    renames={'Tracking__': 'TrackingNumber'},
+    # Tracking numbers that are just = or ""
+    drop_values={'TrackingNumber': ['=', '""']},
+    placeholder_columns=STAMP_ORDERS_PLACEHOLDER_COLUMNS,
+)
+
+EXTENSIV_TXREGRPT = ReportSpec('ExtensivTxRegRpt', 22)
+
+# The exports run_script.py cleans, by report type; each is expected in a
+# week's folder as <report type>.csv
+REPORT_SPECS = {spec.report_type: spec for spec in (EXPORTED_ORDERS, STAMPS_ORDERS, EXTENSIV_TXREGRPT)}
+
+class ReportPlan:
+    """
+    A ReportSpec compiled against one header row, and optionally a subset
+    of its columns (None for all of them): the final headers, the columns
+    each rule applies to, and each typed column's converter. Everything
+    that depends only on the header is worked out here once, so cleaning
+    a chunk only runs the conversions and rules. Plans pickle, so
+    clean_rows can be sent to shard processes.
+    """
+
+    def __init__(self, spec, raw_headers, columns=None):
+        self.spec = spec
+        self.raw_headers = raw_headers
+        headers = [clean_column_name(h) if spec.clean_names else h for h in raw_headers]
+        self.headers = fit_width([spec.renames.get(h, h) for h in headers], spec.expected_columns)
+        self.columns = None if columns is None else list(columns)
+
+        kept = [h for h in self.headers if columns is None or h in columns]
+        names = {h: clean_column_name(h) for h in kept}
+        self.drop_values = {h: spec.drop_values[names[h]] for h in kept if names[h] in spec.drop_values}
+        self.converters = column_converters(spec.report_type, kept) if spec.coerce else {}
+        self.placeholder_columns = [h for h in kept if names[h] in spec.placeholder_columns]
+
+    def project(self, columns):
+        """This plan limited to columns, or itself when columns is None."""
+        return self if columns is None else compile_plan(self.spec, self.raw_headers, tuple(columns))
+
+    def rule_plan(self):
+        """A plan over only the columns the whole-report rules depend on, for a pre-pass."""
+        return self.project([h for h in self.headers if h in self.drop_values or h in self.placeholder_columns])
+
+    def clean_rows(self, df):
+        """The rules that go row by row, so can run on any chunk or shard."""
+        if self.drop_values:
+            with stage('rules'):
+                for col, values in self.drop_values.items():
+                    df = df.loc[~df[col].isin(values)]
+                # A copy, so the conversions below write to a frame of their own
+                df = df.copy()
+        if self.converters:
+            df = coerce_columns(df, self.spec.report_type, self.converters)
+        if not self.placeholder_columns:
+            with stage('rules'):
+                df = df.dropna(how='all')
+        return df
+
+    def empty_columns(self, df):
+        """The placeholder columns that are empty on every row of df."""
+        with stage('rules'):
+            return [col for col in self.placeholder_columns if df[col].where(df[col].notna(), '').eq('').all()]
+
+    def clean_report(self, df, empty_columns):
+        """The rules that need the whole report, given its empty placeholder columns."""
+        if not self.placeholder_columns:
+            return df
+        with stage('rules'):
+            for col in self.placeholder_columns:
+                df[col] = df[col].where(df[col].notna(), '')
+                if col in empty_columns:
+                    df[col] = self.spec.placeholder
+
+            return df.dropna(how='all')
+
+@lru_cache(maxsize=None)
+def compile_plan(spec, raw_headers, columns=None):
+    """The plan for spec, a tuple of header names and a tuple of columns to keep, built once per process."""
+    return ReportPlan(spec, raw_headers, columns)
+
+def report_plan(spec, file_path):
+    headers = read_header(file_path)
+    if len(headers) != spec.expected_columns:
+        logging.warning(f"Header row has {len(headers)} columns, but expected {spec.expected_columns}.")
+    return compile_plan(spec, tuple(headers))
+
+def read_report(plan, file_path, budget=None, shards=1):
+    """
+    Read and clean a whole export with plan, in shards if asked (see
+    read_clean_rows). Returns the DataFrame and its (row_num, row)
+    problematic rows.
+    """
+    spec = plan.spec
+    df, problematic_rows = read_clean_rows(file_path, plan.headers, spec.expected_columns, plan.clean_rows,
+                                           budget or report_budget(spec.report_type), shards, plan.columns)
+    # The placeholder rule looks at whole columns, so it runs once the
+    # shards are back together
+    if plan.placeholder_columns:
+        df = plan.clean_report(df, plan.empty_columns(df))
+    return df, problematic_rows
+
+def iter_report(plan, file_path, chunk_rows, budget=None):
+    """Yield an export's cleaned rows in chunks of at most chunk_rows rows, as plan cleans them."""
+    spec = plan.spec
+    budget = budget or report_budget(spec.report_type)
+
+    # The placeholder rule looks at whole columns, so a cheap pre-pass over
+    # just the columns it depends on settles it before any chunk is written.
+    empty_columns = []
+    if plan.placeholder_columns:
+        rules = plan.rule_plan()
+        filled_columns = set()
+        for df, problematic_rows in iter_rows(file_path, plan.headers, spec.expected_columns, chunk_rows,
+                                              rules.columns, log=False, budget=budget):
+            df = rules.clean_rows(df)
+            filled_columns.update(col for col in rules.placeholder_columns if col not in rules.empty_columns(df))
+        empty_columns = [col for col in plan.placeholder_columns if col not in filled_columns]
+
+    for df, problematic_rows in iter_rows(file_path, plan.headers, spec.expected_columns, chunk_rows,
+                                          plan.columns, budget=budget):
+        yield plan.clean_report(plan.clean_rows(df), empty_columns)
@@ -0,0 +1,166 @@
+import logging
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from report_schemas import ROW_HASH_COLUMN, WEEK_COLUMN, arrow_schema
+from run_metrics import count, stage
+
+# The column that identifies a row across weeks, per report type. Only
+# these reports can be loaded as a delta.
+DELTA_KEYS = {
+    'Exported Orders': 'OrderId',
+    'Stamps Orders': 'TrackingNumber',
+}
+
+# Delta mode merges into one table per report type holding the latest
+# version of each row, named after the report type with this suffix
+DELTA_TABLE_SUFFIX = '_Current'
+
+# Key values that identify nothing; INTEGER keys that didn't parse are 0
+BLANK_KEYS = ['', '0']
+
+INDEX_NAME = '{report_type} delta index.parquet'
+
+def index_path(cleaned_folder, report_type):
+    return os.path.join(cleaned_folder, INDEX_NAME.format(report_type=report_type))
+
+def row_hashes(df):
+    """
+    A 64-bit hash of each row's values, the same whatever order the columns
+    come in. Stored as int64, which is what BigQuery and SQLite hold.
+    """
+    return pd.util.hash_pandas_object(df[sorted(df.columns)], index=False).to_numpy().view(np.int64)
+
+class DeltaIndex:
+    """
+    The hash of the latest loaded version of every row of one report type,
+    by key, with the week that loaded it. Kept as a small Parquet file in
+    the cleaned folder and only updated once a delta has been loaded.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if os.path.exists(path):
+            table = pq.read_table(path)
+            self.keys = pd.Index(table['key'].to_numpy(zero_copy_only=False))
+            self.hashes = table[ROW_HASH_COLUMN].to_numpy()
+            self.weeks = table[WEEK_COLUMN].to_numpy()
+        else:
+            self.keys = pd.Index([], dtype=object)
+            self.hashes = np.array([], dtype=np.int64)
+            self.weeks = np.array([], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def classify(self, keys, hashes):
+        """Boolean arrays marking which rows are new and which have changed since they were loaded."""
+        found = self.keys.get_indexer(keys)
+        known = found >= 0
+        changed = np.zeros(len(keys), dtype=bool)
+        changed[known] = self.hashes[found[known]] != hashes[known]
+        return ~known, changed
+
+    def update(self, keys, hashes, weeks):
+        """Record loaded rows; a key keeps the version from the latest week."""
+        merged = pd.DataFrame({
+            'key': np.concatenate([self.keys.to_numpy(dtype=object), np.asarray(keys, dtype=object)]),
+            ROW_HASH_COLUMN: np.concatenate([self.hashes, hashes]),
+            WEEK_COLUMN: np.concatenate([self.weeks, weeks]),
+        })
+        merged = merged.sort_values(WEEK_COLUMN, kind='stable').drop_duplicates('key', keep='last')
+        self.keys = pd.Index(merged['key'].to_numpy())
+        self.hashes = merged[ROW_HASH_COLUMN].to_numpy()
+        self.weeks = merged[WEEK_COLUMN].to_numpy()
+
+        part = f"{self.path}.part"
+        pq.write_table(pa.Table.from_pandas(merged, preserve_index=False), part)
+        os.replace(part, self.path)
+
+class DeltaWriter:
+    """
+    Picks out the rows of one week's cleaned report that are new or changed
+    since the last loaded week, and writes them with their row hash and
+    week to a Parquet file for the MERGE. A key that appears more than
+    once in the week keeps its first row, since a MERGE can only take one
+    row per key. Works on the whole report or on streamed chunks. Used as
+    a context manager, it removes its half-written file if cleaning fails.
+    """
+
+    def __init__(self, report_type, index, path, week_number, compression='snappy'):
+        self.report_type = report_type
+        self.key = DELTA_KEYS[report_type]
+        self.index = index
+        self.path = path
+        self.week_number = week_number
+        self.compression = compression
+        self.columns = None
+        self.counts = {'new': 0, 'changed': 0, 'unchanged': 0, 'no_key': 0}
+        self._seen = set()
+        self._writer = None
+
+    def add(self, df):
+        with stage('delta'):
+            keys = df[self.key].astype(str).str.strip()
+            blank = keys.isin(BLANK_KEYS).to_numpy()
+            repeated = keys.duplicated().to_numpy() | keys.isin(self._seen).to_numpy()
+            usable = ~blank & ~repeated
+            self._seen.update(keys[usable])
+
+            rows = df[usable]
+            hashes = row_hashes(rows)
+            new, changed = self.index.classify(keys[usable], hashes)
+            self.counts['new'] += int(new.sum())
+            self.counts['changed'] += int(changed.sum())
+            self.counts['unchanged'] += int((~new & ~changed).sum())
+            self.counts['no_key'] += int(blank.sum())
+
+            delta = rows[new | changed].copy()
+            delta[ROW_HASH_COLUMN] = hashes[new | changed]
+            delta[WEEK_COLUMN] = self.week_number
+            if self._writer is None:
+                self.columns = list(delta.columns)
+                self._writer = pq.ParquetWriter(f"{self.path}.part", arrow_schema(self.report_type, self.columns),
+                                                coerce_timestamps='us', allow_truncated_timestamps=True,
+                                                compression=self.compression)
+            self._writer.write_table(pa.Table.from_pandas(delta[self.columns], schema=self._writer.schema,
+                                                          preserve_index=False))
+            count('delta', rows=len(delta))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is not None:
+            self.abort()
+
+    def tee(self, chunks):
+        for df in chunks:
+            self.add(df)
+            yield df
+
+    def close(self):
+        """Put the delta file in place and return the delta's column names."""
+        self._writer.close()
+        self._writer = None
+        os.replace(f"{self.path}.part", self.path)
+        count('delta', **self.counts)
+        counts = ', '.join(f"{rows} {name.replace('_', ' ')}" for name, rows in self.counts.items())
+        logging.info(f"{self.report_type} rows against {len(self.index)} loaded keys: {counts}.")
+        return self.columns
+
+    def abort(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if os.path.exists(f"{self.path}.part"):
+            os.remove(f"{self.path}.part")
+
+def update_index(path, delta_path, key):
+    """Add a loaded delta file's rows to the index at path."""
+    table = pq.read_table(delta_path, columns=[key, ROW_HASH_COLUMN, WEEK_COLUMN])
+    index = DeltaIndex(path)
+    index.update(pd.Series(table[key].to_numpy(zero_copy_only=False)).astype(str).str.strip().to_numpy(),
+                 table[ROW_HASH_COLUMN].to_numpy(), table[WEEK_COLUMN].to_numpy())
@@ -0,0 +1,94 @@
+import hashlib
+import json
+import os
+import re
+
+MANIFEST_NAME = 'manifest.json'
+
+# How far a report got, in order. A report is checkpointed once its cleaned
+# file is written, again with the load job's ID just before the job is
+# submitted, and once more when the job has finished.
+CHECKPOINTS = ['cleaned', 'submitted', 'loaded']
+
+def file_digest(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def sources_digest(digests):
+    """One digest for a report built from several inputs, from each input's digest in order."""
+    return hashlib.sha256(':'.join(digests).encode('utf-8')).hexdigest()
+
+def rules_digest(source_paths, **settings):
+    """
+    Fingerprint of the cleaning rules: the source of the modules that clean
+    and load a report, plus any settings that change what gets written.
+    """
+    digest = hashlib.sha256()
+    for path in source_paths:
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    digest.update(json.dumps(settings, sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+def load_job_id(key, input_sha256, rules, table_id, run_id, attempt=0):
+    """
+    The ID of a report's load job: its input, rules and destination, the
+    run submitting it (run_id) and the attempt, which moves on once a job
+    has failed. The run keeps a job of an earlier run with the same input
+    from ever being taken for this one, even if the manifest is lost; a
+    job is only looked up again by the ID its checkpoint recorded.
+    """
+    digest = hashlib.sha256(f"{input_sha256}:{rules}:{table_id}".encode('utf-8')).hexdigest()[:24]
+    return f"pct_{re.sub(r'[^a-zA-Z0-9_]', '_', key)}_{digest}_{run_id}_{attempt}"
+
+class Manifest:
+    """
+    Record of what each report's last run got done, kept next to the
+    cleaned files. There is one entry per week and report type, holding the
+    hash of the input it was cleaned from, the cleaning rules, the cleaned
+    artifact, its last checkpoint (see CHECKPOINTS) and the ID of the load
+    job that loads it. Entries from before checkpoints were recorded were
+    all loaded.
+    """
+
+    def __init__(self, folder):
+        self.path = os.path.join(folder, MANIFEST_NAME)
+        self.entries = {}
+        if os.path.exists(self.path):
+            with open(self.path, encoding='utf-8') as f:
+                self.entries = json.load(f)
+
+    @staticmethod
+    def key(week, report_type):
+        return f"{week}/{report_type}"
+
+    def is_current(self, key, input_sha256, rules, table_id):
+        """True if the same input was already cleaned and loaded the same way."""
+        entry = self.resumable(key, input_sha256, rules, table_id)
+        return entry is not None and entry.get('checkpoint', 'loaded') == 'loaded'
+
+    def resumable(self, key, input_sha256, rules, table_id):
+        """The entry of a run of the same input and rules into table_id whose cleaned file is still there."""
+        entry = self.entries.get(key)
+        if (entry is not None
+                and entry['input_sha256'] == input_sha256
+                and entry['rules'] == rules
+                and entry['table_id'] == table_id
+                and os.path.exists(entry['artifact'])):
+            return entry
+        return None
+
+    def record(self, key, **entry):
+        self.entries[key] = entry
+        self.save()
+
+    def save(self):
+        # Written in full and swapped in, so an interrupted run can't leave
+        # a half-written manifest behind
+        part = f"{self.path}.part"
+        with open(part, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, indent=2, sort_keys=True)
+        os.replace(part, self.path)
@@ -0,0 +1,172 @@
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+METRICS_FILE = 'run_metrics.jsonl'
+
+# Stages in the order a report goes through them
+STAGES = ['parse', 'clean_rows', 'coerce', 'rules', 'delta', 'compact', 'write', 'upload', 'load_job']
+
+_current = None
+
+def peak_rss_mb():
+    """Peak resident memory of this process since reset_peak_rss(), or since it started."""
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD)] + \
+                       [(name, ctypes.c_size_t) for name in (
+                           'PeakWorkingSetSize', 'WorkingSetSize', 'QuotaPeakPagedPoolUsage',
+                           'QuotaPagedPoolUsage', 'QuotaPeakNonPagedPoolUsage', 'QuotaNonPagedPoolUsage',
+                           'PagefileUsage', 'PeakPagefileUsage')]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(),
+                                                 ctypes.byref(counters), counters.cb)
+        return counters.PeakWorkingSetSize / (1024 * 1024)
+
+    # On Linux, ru_maxrss also counts what the parent held when it started
+    # this process, so read the high-water mark of this process itself
+    if os.path.exists('/proc/self/status'):
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def reset_peak_rss():
+    """
+    Start the peak over from the memory in use now, so a report's figure
+    isn't the peak of a report cleaned before it in the same process.
+    Only Linux can; elsewhere the peak stays the process's own.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+class ReportMetrics:
+    """
+    Wall time, row and byte counts and peak memory for each stage of one
+    report. A stage's time excludes any stage nested inside it, so the
+    stage times add up to the time spent in stages. Streaming mode enters
+    the same stage once per chunk; the numbers accumulate.
+    """
+
+    def __init__(self, report, week):
+        self.report = report
+        self.week = week
+        self.stages = {}
+        self._nested = []
+
+    def _stage(self, name):
+        return self.stages.setdefault(name, {'seconds': 0.0})
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        self._nested.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = self._nested.pop()
+            if self._nested:
+                self._nested[-1] += elapsed
+            stage = self._stage(name)
+            stage['seconds'] += elapsed - nested
+            stage['peak_rss_mb'] = round(peak_rss_mb(), 1)
+
+    def add(self, name, **counts):
+        stage = self._stage(name)
+        for key, value in counts.items():
+            stage[key] = stage.get(key, 0) + value
+
+    def set(self, name, **values):
+        self._stage(name).update(values)
+
+    def merge(self, stages):
+        """Add the stages another process collected, keeping the higher peak memory."""
+        for name, values in stages.items():
+            stage = self._stage(name)
+            for key, value in values.items():
+                if key == 'peak_rss_mb':
+                    stage[key] = max(stage.get(key, 0), value)
+                else:
+                    stage[key] = stage.get(key, 0) + value
+
+    def to_record(self):
+        ordered = sorted(self.stages, key=lambda name: STAGES.index(name) if name in STAGES else len(STAGES))
+        stages = {name: dict(self.stages[name], seconds=round(self.stages[name]['seconds'], 4))
+                  for name in ordered}
+        return {
+            'report': self.report,
+            'week': self.week,
+            'stages': stages,
+            'peak_rss_mb': max((stage.get('peak_rss_mb', 0) for stage in stages.values()), default=None),
+        }
+
+    # The nesting stack only means something inside the process timing it
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_nested'] = []
+        return state
+
+@contextmanager
+def collecting(metrics):
+    """Send stage() and count() calls in this process to metrics."""
+    global _current
+    previous = _current
+    if previous is None:
+        reset_peak_rss()
+    _current = metrics
+    try:
+        yield metrics
+    finally:
+        _current = previous
+
+def stage(name):
+    return _current.stage(name) if _current is not None else nullcontext()
+
+def count(name, **counts):
+    if _current is not None:
+        _current.add(name, **counts)
+
+def note(name, **values):
+    """Set values on a stage of the current report, for facts that don't add up like counts."""
+    if _current is not None:
+        _current.set(name, **values)
+
+def merge(stages):
+    if _current is not None:
+        _current.merge(stages)
+
+def timed(iterable, name):
+    """Yield from iterable, timing only the work of producing each item."""
+    iterator = iter(iterable)
+    done = object()
+    while True:
+        with stage(name):
+            item = next(iterator, done)
+        if item is done:
+            return
+        yield item
+
+def write_metrics(record, path=METRICS_FILE):
+    # One JSON object per line, appended, so runs can be trended over weeks
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record) + '\n')
+
+def run_started():
+    return datetime.now().isoformat(timespec='seconds')
@@ -1,330 +1,903 @@
+import argparse
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import ExitStack, nullcontext
 import csv
-import pandas as pd
+from functools import partial
+from itertools import islice
 import logging
-from google.cloud import bigquery
+import logging.handlers
+import multiprocessing
 import os
-import numpy as np
-import re
+import uuid
+import pyarrow as pa
+import pyarrow.parquet as pq
+from bigquery_uploads import LoadJobs
+import csv_ingest
+from csv_ingest import read_header
+import postage_comparison
+from postage_comparison import (COMPARISON_REPORT, EXPORTED_COMPARISON_COLUMNS, STAMPS_COMPARISON_COLUMNS,
+                                build_comparison, read_cleaned)
+from quarantine import Quarantine, quarantining
+import report_schemas
+from report_schemas import (COMPACT_PARQUET_COMPRESSION, REPORT_CLUSTERING, REPORT_PROJECTIONS, WEEK_COLUMN,
+                            WEEK_PARTITIONS, arrow_schema, compact_columns, report_budget)
+import report_specs
+from report_specs import (EXPORTED_ORDERS, EXTENSIV_TXREGRPT, REPORT_SPECS, STAMPS_ORDERS, iter_report, read_report,
+                          report_plan)
+from run_manifest import Manifest, file_digest, load_job_id, rules_digest, sources_digest
+from row_delta import DELTA_KEYS, DELTA_TABLE_SUFFIX, DeltaIndex, DeltaWriter, index_path, update_index
+from run_metrics import ReportMetrics, collecting, count, note, run_started, stage, write_metrics
+from sinks import SINKS, SQLITE_NAME, BigQuerySink, make_sink
 
 # Configure logging
 logging.basicConfig(filename='data_cleaning.log', level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s')
 
-def clean_column_name(column_name):
-    if not column_name:  # Check if column_name is empty
-        return '_empty_'
-    # Replace spaces and special characters with underscores
-    cleaned_name = re.sub(r'[^a-zA-Z0-9_]', '_', column_name)
-    # Ensure the name starts with a letter or underscore
-    if not cleaned_name[0].isalpha() and cleaned_name[0] != '_':
-        cleaned_name = '_' + cleaned_name
-    return cleaned_name
-
-def process_exported_orders(file_path, week):
-    expected_columns = 33
-    valid_rows = []
-    problematic_rows = []
-    
+# Rows per chunk in streaming mode
+DEFAULT_CHUNK_ROWS = 50000
+
+# Every report type this script cleans or builds
+REPORT_TYPES = [*REPORT_SPECS, COMPARISON_REPORT]
+
+def required_columns(report_type):
+    """The columns a report keeps whatever its projection says: the ones its rules and its clustering read."""
+    spec = REPORT_SPECS.get(report_type)
+    columns = list(spec.drop_values) if spec is not None else []
+    return columns + [col for col in REPORT_CLUSTERING.get(report_type, []) if col not in columns]
+
+# Columns the postage comparison reads from the reports it is built from
+COMPARISON_COLUMNS = {
+    'Exported Orders': EXPORTED_COMPARISON_COLUMNS,
+    'Stamps Orders': STAMPS_COMPARISON_COLUMNS,
+}
+
+def run_projection(report_type, projection, delta=False, compare=False):
+    """
+    projection plus the columns delta mode and the postage comparison read
+    from report_type, when they are on; None still keeps every column.
+    """
+    if projection is None:
+        return None
+    needed = [DELTA_KEYS[report_type]] if delta and report_type in DELTA_KEYS else []
+    needed += COMPARISON_COLUMNS.get(report_type, []) if compare else []
+    return list(projection) + [col for col in needed if col not in projection]
+
+def project(report_type, headers, projection=None):
+    """
+    The headers to keep under projection, a list of column names, or None
+    to keep them all. The dropped columns go in the report's metrics.
+    """
+    if projection is None:
+        return None
+    unknown = [col for col in projection if col not in headers]
+    if unknown:
+        logging.warning(f"⚠️ {report_type} has no column {', '.join(unknown)} to keep.")
+    keep = set(projection) | set(required_columns(report_type))
+    if not keep.intersection(headers):
+        logging.warning(f"⚠️ None of the {report_type} columns to keep are in the file; keeping them all.")
+        return None
+    dropped = [h for h in headers if h not in keep]
+    note('parse', dropped_columns=dropped)
+    if dropped:
+        logging.info(f"{report_type}: dropping {len(dropped)} of {len(headers)} columns: {', '.join(dropped)}")
+    return [h for h in headers if h in keep]
+
+def process_report(spec, file_path, week, budget=None, shards=1, columns=None):
+    """Clean a whole export as its ReportSpec says; columns is its projection."""
     try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            reader = csv.reader(file)
-            headers = next(reader)
-            
-            # Clean the headers
-            headers = [clean_column_name(h) for h in headers]
-            
-            if len(headers) != expected_columns:
-                logging.warning(f"Header row has {len(headers)} columns, but expected {expected_columns}.")
-                if len(headers) < expected_columns:
-                    headers += [f"Column_{i+1}" for i in range(len(headers), expected_columns)]
-                else:
-                    headers = headers[:expected_columns]
-
-            for row_num, row in enumerate(reader, start=1):
-                try:
-                    if not row:
-                        logging.warning(f"Skipping empty row at line {row_num}")
-                        continue
-                        
-                    cleaned_row = []
-                    for value in row:
-                        cleaned_value = value.strip().replace('\n', ' ').replace('\r', '')
-                        cleaned_row.append(cleaned_value)
-                    
-                    if len(cleaned_row) == expected_columns:
-                        valid_rows.append(cleaned_row)
-                    else:
-                        if len(cleaned_row) > expected_columns:
-                            cleaned_row = cleaned_row[:expected_columns]
-                            logging.warning(f"Row {row_num} has {len(row)} columns. Truncated to {expected_columns} columns.")
-                        else:
-                            cleaned_row += [""] * (expected_columns - len(cleaned_row))
-                            logging.warning(f"Row {row_num} has {len(row)} columns. Padded to {expected_columns} columns.")
-                        
-                        valid_rows.append(cleaned_row)
-                        problematic_rows.append((row_num, row))
-
-                except Exception as e:
-                    logging.error(f"Error processing row {row_num}: {str(e)}")
-                    problematic_rows.append((row_num, f"Error processing row: {str(e)}"))
-
-        df = pd.DataFrame(valid_rows, columns=headers)
-
-        numeric_columns = {
-            'RowNumber': 'int',
-            'OrderId': 'int', 
-            'CreationDate': 'datetime64[ns]',
-            'BatchOrderId': 'int',
-            'TotPackages': 'int',
-            'ParcelLabelType': 'int',
-            'SmallParcelShipDate': 'datetime64[ns]',
-            'TotalItemQty': 'int',
-            'TotVolumeImperial': 'float'
-        }
-
-        for col, dtype in numeric_columns.items():
-            if col in df.columns:
-                if dtype == 'int':
-                    df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(int)
-                elif dtype == 'float':
-                    df[col] = pd.to_numeric(df[col], errors='coerce')
-                elif dtype == 'datetime64[ns]':
-                    df[col] = pd.to_datetime(df[col], errors='coerce')
-
-        df = df.dropna(how='all')
-        
+        plan = report_plan(spec, file_path)
+        plan = plan.project(project(spec.report_type, plan.headers, columns))
+        df, problematic_rows = read_report(plan, file_path, budget, shards)
+        if problematic_rows:
+            logging.warning(f"Found {len(problematic_rows)} problematic rows that required cleaning.")
+
         return df
 
     except Exception as e:
-        logging.error(f"Error processing Exported Orders: {str(e)}")
+        logging.error(f"Error processing {spec.report_type}: {str(e)}")
         raise
 
-def process_stamp_orders(file_path, week):
-    expected_columns = 44
-    valid_rows = []
-    problematic_rows = []
-    
+def stream_report(spec, file_path, week, chunk_rows=DEFAULT_CHUNK_ROWS, budget=None, columns=None):
+    """process_report() in chunks of at most chunk_rows rows."""
     try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            reader = csv.reader(file)
-            headers = next(reader)
-            
-            # Clean the headers
-            headers = [clean_column_name(h) for h in headers]
-            # Replace Tracking__ with TrackingNumber
-            headers = ['TrackingNumber' if h == 'Tracking__' else h for h in headers]
-            
-            if len(headers) != expected_columns:
-                logging.warning(f"Header row has {len(headers)} columns, but expected {expected_columns}.")
-                if len(headers) < expected_columns:
-                    headers += [f"Column_{i+1}" for i in range(len(headers), expected_columns)]
-                else:
-                    headers = headers[:expected_columns]
-
-            for row_num, row in enumerate(reader, start=1):
-                try:
-                    if not row:
-                        logging.warning(f"Skipping empty row at line {row_num}")
-                        continue
-                        
-                    cleaned_row = []
-                    for value in row:
-                        cleaned_value = value.strip().replace('\n', ' ').replace('\r', '')
-                        cleaned_row.append(cleaned_value)
-                    
-                    if len(cleaned_row) == expected_columns:
-                        valid_rows.append(cleaned_row)
-                    else:
-                        if len(cleaned_row) > expected_columns:
-                            cleaned_row = cleaned_row[:expected_columns]
-                            logging.warning(f"Row {row_num} has {len(row)} columns. Truncated to {expected_columns} columns.")
-                        else:
-                            cleaned_row += [""] * (expected_columns - len(cleaned_row))
-                            logging.warning(f"Row {row_num} has {len(row)} columns. Padded to {expected_columns} columns.")
-                        
-                        valid_rows.append(cleaned_row)
-                        problematic_rows.append((row_num, row))
-
-                except Exception as e:
-                    logging.error(f"Error processing row {row_num}: {str(e)}")
-                    problematic_rows.append((row_num, f"Error processing row: {str(e)}"))
-
-        df = pd.DataFrame(valid_rows, columns=headers)
-
-        # Remove tracking numbers that are just = or ""
-        if 'TrackingNumber' in df.columns:
-            df = df[~df['TrackingNumber'].isin(['=', '""'])]
-
-        if "Postal_Code" in df.columns:
-            df['Postal_Code'] = df['Postal_Code'].replace(['NA', 'N/A', ''], np.nan)
-            df['Postal_Code'] = pd.to_numeric(df['Postal_Code'], errors='coerce').fillna(0).astype(int)
-
-        date_columns = ['Date_Printed', 'Date_Delivered']
-        float_columns = ['Quoted_Amount', 'Extra_Services']
-        integer_columns = ['Origin_Zip', 'Insured_For', 'Duties_and_Taxes_Amount']
-
-        for col in date_columns:
-            if col in df.columns:
-                df[col] = pd.to_datetime(df[col], errors='coerce')
-
-        for col in float_columns:
-            if col in df.columns:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-
-        for col in integer_columns:
-            if col in df.columns:
-                df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(int)
-
-        columns_to_check = ['Extra_Services', 'Cost_Code', 'Refund_Request_Date', 'Refund_Status',
-                            'Refund_Requested', 'Reference_1', 'Order_ID', 'Store',
-                            'Order_Date', 'Order_Total', 'Item_SKUs', 'Items',
-                            'Product_Total', 'Shipping_Paid', 'Tax_Paid']
-
-        for col in columns_to_check:
-            if col in df.columns:
-                df[col] = df[col].where(df[col].notna(), '')
-                if df[col].eq('').all():
-                    df[col] = '#NUM!'
-
-        for addr in ['Address_2', 'Address_3']:
-            if addr in df.columns:
-                df[addr] = df[addr].where(df[addr].notna(), '')
-                if df[addr].eq('').all():
-                    df[addr] = '#NUM!'
-
-        df = df.dropna(how='all')
-        
-        return df
+        # Exceeding the error budget raises between chunks, which still stops
+        # the caller before anything is uploaded
+        plan = report_plan(spec, file_path)
+        plan = plan.project(project(spec.report_type, plan.headers, columns))
+        yield from iter_report(plan, file_path, chunk_rows, budget)
 
     except Exception as e:
-        logging.error(f"Error processing Stamp Orders: {str(e)}")
+        logging.error(f"Error processing {spec.report_type}: {str(e)}")
         raise
 
-def process_extensiv_txregrpt(file_path, week):
-    expected_columns = 22
-    valid_rows = []
-    problematic_rows = []
-    
-    try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            reader = csv.reader(file)
-            headers = next(reader)
-            
-            # Clean the headers
-            headers = [clean_column_name(h) for h in headers]
-            
-            if len(headers) != expected_columns:
-                logging.warning(f"Header row has {len(headers)} columns, but expected {expected_columns}.")
-                if len(headers) < expected_columns:
-                    headers += [f"Column_{i+1}" for i in range(len(headers), expected_columns)]
-                else:
-                    headers = headers[:expected_columns]
-
-            for row_num, row in enumerate(reader, start=1):
-                try:
-                    if not row:
-                        logging.warning(f"Skipping empty row at line {row_num}")
-                        continue
-                        
-                    cleaned_row = []
-                    for value in row:
-                        cleaned_value = value.strip().replace('\n', ' ').replace('\r', '')
-                        cleaned_row.append(cleaned_value)
-                    
-                    if len(cleaned_row) == expected_columns:
-                        valid_rows.append(cleaned_row)
-                    else:
-                        if len(cleaned_row) > expected_columns:
-                            cleaned_row = cleaned_row[:expected_columns]
-                            logging.warning(f"Row {row_num} has {len(row)} columns. Truncated to {expected_columns} columns.")
-                        else:
-                            cleaned_row += [""] * (expected_columns - len(cleaned_row))
-                            logging.warning(f"Row {row_num} has {len(row)} columns. Padded to {expected_columns} columns.")
-                        
-                        valid_rows.append(cleaned_row)
-                        problematic_rows.append((row_num, row))
-
-                except Exception as e:
-                    logging.error(f"Error processing row {row_num}: {str(e)}")
-                    problematic_rows.append((row_num, f"Error processing row: {str(e)}"))
-
-        df = pd.DataFrame(valid_rows, columns=headers)
-        df = df.dropna(how='all')
+process_exported_orders = partial(process_report, EXPORTED_ORDERS)
+process_stamp_orders = partial(process_report, STAMPS_ORDERS)
+process_extensiv_txregrpt = partial(process_report, EXTENSIV_TXREGRPT)
 
-        if problematic_rows:
-            logging.warning(f"Found {len(problematic_rows)} problematic rows that required cleaning.")
-            for row_num, row in problematic_rows:
-                logging.warning(f"Row {row_num}: {row}")
+stream_exported_orders = partial(stream_report, EXPORTED_ORDERS)
+stream_stamp_orders = partial(stream_report, STAMPS_ORDERS)
+stream_extensiv_txregrpt = partial(stream_report, EXTENSIV_TXREGRPT)
 
-        if len(problematic_rows) > 0:
-            logging.error(f"CSV processing encountered too many errors, giving up. Rows: {len(valid_rows) + len(problematic_rows)}; errors: {len(problematic_rows)}; max bad: 0; error percent: {len(problematic_rows) / (len(valid_rows) + len(problematic_rows)) * 100:.2f}%")
-            raise Exception(f"CSV processing encountered too many errors, giving up. Total rows: {len(valid_rows) + len(problematic_rows)}; Total errors: {len(problematic_rows)}.")
+# Expected file names, one per ReportSpec
+EXPECTED_FILES = {f"{report_type}.csv": partial(process_report, spec) for report_type, spec in REPORT_SPECS.items()}
 
-        return df
+STREAMING_FILES = {f"{report_type}.csv": partial(stream_report, spec) for report_type, spec in REPORT_SPECS.items()}
+
+def process_postage_comparison(sources, week, budget=None, shards=1, columns=None):
+    """
+    Build the week's postage comparison from the cleaned Exported Orders and
+    Stamps Orders files in sources, a (filename, cleaned file) list. The
+    rows that match nothing go to a side report next to the cleaned files.
+    columns is the comparison's projection, applied to the joined rows.
+    """
+    try:
+        sources = dict(sources)
+        with stage('parse'):
+            exported = read_cleaned(sources['Exported Orders.csv'], 'Exported Orders', EXPORTED_COMPARISON_COLUMNS)
+            stamps = read_cleaned(sources['Stamps Orders.csv'], 'Stamps Orders', STAMPS_COMPARISON_COLUMNS)
+            count('parse', rows=len(exported) + len(stamps))
+        df, unmatched = build_comparison(exported, stamps)
+
+        unmatched_path = os.path.join(os.path.dirname(sources['Exported Orders.csv']),
+                                      f"{week} {COMPARISON_REPORT}.unmatched.csv")
+        with stage('write'):
+            unmatched.to_csv(unmatched_path, index=False, quoting=csv.QUOTE_ALL)
+        if len(unmatched):
+            reasons = ', '.join(f"{reason}: {rows}" for reason, rows in unmatched['Reason'].value_counts().items())
+            logging.warning(f"{len(unmatched)} rows matched nothing ({reasons}), see {unmatched_path}.")
+        logging.info(f"Matched {len(df)} of {len(exported)} orders to {len(stamps)} labels.")
+        kept = project(COMPARISON_REPORT, list(df.columns), columns)
+        return df if kept is None else df[kept]
 
     except Exception as e:
-        logging.error(f"Error processing Extensiv TxRegRpt: {str(e)}")
+        logging.error(f"Error building Postage Comparison: {str(e)}")
         raise
 
-def main():
-    # Get folder path from user
-    folder_path = input("Please drag and drop the folder containing the CSV files: ").strip('"')
-    
-    # Get week number from user and prepend "week"
-    week_num = input("Please enter the week number (e.g., 1): ")
-    week = f"week{week_num}"
-    
+# Reports built from other reports' cleaned files rather than an export,
+# and the cleaned reports each needs
+BUILT_FILES = {
+    f"{COMPARISON_REPORT}.csv": process_postage_comparison
+}
+
+BUILT_FROM = {
+    f"{COMPARISON_REPORT}.csv": ['Exported Orders.csv', 'Stamps Orders.csv']
+}
+
+def write_parquet(df, path, schema, compression='snappy'):
+    # BigQuery reads microsecond timestamps, so store them at that precision
+    table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+    pq.write_table(table, path, coerce_timestamps='us', allow_truncated_timestamps=True, compression=compression)
+
+def save_chunks(chunks, report_type, csv_path=None, parquet_path=None, compression='snappy'):
+    """
+    Append each cleaned chunk to a CSV at csv_path and/or a Parquet file at
+    parquet_path, so only one chunk is ever held in memory. The files are
+    written under temporary names and only put in place once every chunk
+    has gone through. Returns the cleaned data's column names.
+    """
+    csv_part = f"{csv_path}.part" if csv_path else None
+    parquet_part = f"{parquet_path}.part" if parquet_path else None
+    csv_file = None
+    writer = None
+    columns = []
+
+    try:
+        if csv_part:
+            csv_file = open(csv_part, 'w', newline='', encoding='utf-8')
+
+        for i, df in enumerate(chunks):
+            if i == 0:
+                columns = list(df.columns)
+
+            with stage('write'):
+                if csv_file:
+                    # pandas drops the time part when a whole frame is at midnight;
+                    # pin the format so every chunk agrees
+                    df.to_csv(csv_file, index=False, header=(i == 0), quoting=csv.QUOTE_ALL,
+                              date_format='%Y-%m-%d %H:%M:%S')
+
+                if parquet_part:
+                    # The declared schema fixes every column's type up front, so
+                    # an all-empty first chunk can't pin a column to the wrong one
+                    if writer is None:
+                        writer = pq.ParquetWriter(parquet_part, arrow_schema(report_type, columns),
+                                                  coerce_timestamps='us', allow_truncated_timestamps=True,
+                                                  compression=compression)
+                    writer.write_table(pa.Table.from_pandas(df, schema=writer.schema, preserve_index=False))
+                count('write', rows=len(df))
+
+        with stage('write'):
+            if csv_file:
+                csv_file.close()
+                csv_file = None
+                os.replace(csv_part, csv_path)
+            if writer is not None:
+                writer.close()
+                writer = None
+                os.replace(parquet_part, parquet_path)
+        return columns
+
+    finally:
+        if csv_file:
+            csv_file.close()
+        if writer is not None:
+            writer.close()
+        for path in (csv_part, parquet_part):
+            if path and os.path.exists(path):
+                os.remove(path)
+
+# What clean_report hands to upload_report: either the cleaned DataFrame, or
+# a Parquet file on disk, plus its column names. spool marks a
+# Parquet file that only exists for the upload and is removed once it has
+# been sent. partition is the week number when the report goes into the
+# partitioned table of its report type, otherwise None. artifact_path is
+# the cleaned file kept in the cleaned folder, metrics the report's
+# ReportMetrics, compression the Parquet compression of whatever is sent,
+# and week the week it was cleaned for. A delta's parquet_path holds only its
+# new and changed rows, to be merged on merge_key.
+CleanedReport = namedtuple('CleanedReport', ['filename', 'table_id', 'df', 'parquet_path', 'columns', 'spool',
+                                             'partition', 'artifact_path', 'metrics', 'compression', 'week',
+                                             'merge_key'], defaults=[None])
+
+ARTIFACT_FORMATS = ('csv', 'parquet')
+
+def with_week(chunks, week_number):
+    for df in chunks:
+        df[WEEK_COLUMN] = week_number
+        yield df
+
+def compacted(chunks, report_type):
+    for df in chunks:
+        yield compact_columns(df, report_type)
+
+def report_table_id(filename, week, partition=None, delta=False):
+    dataset_id = 'postage-calculator-tool.pct'
+    report_type = filename.replace('.csv', '')
+    # Partitioned mode keeps every week in one table per report type, and
+    # delta mode the latest version of every row
+    if delta and report_type in DELTA_KEYS:
+        table_name = f"{report_type}{DELTA_TABLE_SUFFIX}".replace(' ', '_')
+    else:
+        table_name = (report_type if partition is not None else f"{week} {report_type}").replace(' ', '_')
+    return f"{dataset_id}.{table_name}"
+
+def clean_report(filename, file_path, week, cleaned_folder, chunk_rows=None, artifact='csv', partition=None,
+                 compact=False, budget=None, upload=True, shards=1, delta=False, columns=None):
+    # Create output filename with week prefix
+    report_type = filename.replace('.csv', '')
+    report_name = f"{week} {report_type}"
+    csv_path = os.path.join(cleaned_folder, f"{report_name}.csv")
+    parquet_path = os.path.join(cleaned_folder, f"{report_name}.parquet")
+    quarantine_path = os.path.join(cleaned_folder, f"{report_name}.quarantine.jsonl")
+    table_id = report_table_id(filename, week, partition, delta)
+    compression = COMPACT_PARQUET_COMPRESSION if compact else 'snappy'
+    # Only the rows that are new or changed since the weeks already loaded
+    # are uploaded; the cleaned file still has every row
+    delta_writer = None
+    if delta and report_type in DELTA_KEYS:
+        delta_writer = DeltaWriter(report_type, DeltaIndex(index_path(cleaned_folder, report_type)),
+                                   os.path.join(cleaned_folder, f"{report_name}.delta.parquet"), partition,
+                                   compression)
+
+    with collecting(ReportMetrics(report_type, week)) as metrics, quarantining(Quarantine(quarantine_path)), \
+            delta_writer or nullcontext():
+        if filename in BUILT_FILES:
+            # Built whole from the few columns it needs of cleaned files
+            chunk_rows = None
+        if chunk_rows:
+            chunks = STREAMING_FILES[filename](file_path, week, chunk_rows, budget, columns)
+            if delta_writer is not None:
+                chunks = delta_writer.tee(chunks)
+            if partition is not None:
+                chunks = with_week(chunks, partition)
+            if compact:
+                chunks = compacted(chunks, report_type)
+        else:
+            df = (BUILT_FILES.get(filename) or EXPECTED_FILES[filename])(file_path, week, budget, shards, columns)
+            if delta_writer is not None:
+                delta_writer.add(df)
+            if partition is not None:
+                df[WEEK_COLUMN] = partition
+            if compact:
+                df = compact_columns(df, report_type)
+
+        if artifact == 'parquet':
+            # The Parquet file is both the cleaned output and exactly what gets
+            # loaded, so the data is serialized once
+            if chunk_rows:
+                columns = save_chunks(chunks, report_type, parquet_path=parquet_path, compression=compression)
+            else:
+                with stage('write'):
+                    write_parquet(df, parquet_path, arrow_schema(report_type, df.columns), compression)
+                    count('write', rows=len(df))
+                columns = list(df.columns)
+            report = CleanedReport(filename, table_id, None, parquet_path, columns, False, partition, parquet_path,
+                                   metrics, compression, week)
+
+        elif chunk_rows:
+            # Stream the file through in chunks; the upload reads a spool from
+            # disk, which a clean-only run has no use for
+            spool_path = None
+            if upload and delta_writer is None:
+                spool_path = os.path.join(cleaned_folder, f"{report_name}.upload.parquet")
+            columns = save_chunks(chunks, report_type, csv_path, spool_path, compression)
+            report = CleanedReport(filename, table_id, None, spool_path, columns, upload, partition, csv_path,
+                                   metrics, compression, week)
+
+        else:
+            # Save to CSV
+            with stage('write'):
+                df.to_csv(csv_path, index=False, quoting=csv.QUOTE_ALL)
+                count('write', rows=len(df))
+            report = CleanedReport(filename, table_id, df if upload else None, None, list(df.columns), False,
+                                   partition, csv_path, metrics, compression, week)
+
+        if delta_writer is not None:
+            report = report._replace(df=None, parquet_path=delta_writer.path, columns=delta_writer.close(),
+                                     spool=False, merge_key=delta_writer.key)
+
+    # The cleaned file, plus the upload spool when there is one
+    written = {report.artifact_path, report.parquet_path} - {None}
+    metrics.set('write', bytes_out=sum(os.path.getsize(path) for path in written))
+    logging.info(f"✅ {filename} cleaned and saved successfully.")
+    return report
+
+def resume_report(filename, artifact_path, week, partition=None, compression='snappy'):
+    """
+    The CleanedReport of a cleaned file an earlier run wrote, so it can be
+    loaded without cleaning the export again. A Parquet file is loaded as
+    it is; a CSV file is read back with its declared column types.
+    """
+    report_type = filename.replace('.csv', '')
+    table_id = report_table_id(filename, week, partition)
+    with collecting(ReportMetrics(report_type, week)) as metrics:
+        if artifact_path.endswith('.parquet'):
+            return CleanedReport(filename, table_id, None, artifact_path, pq.read_schema(artifact_path).names,
+                                 False, partition, artifact_path, metrics, compression, week)
+        with stage('parse'):
+            df = read_cleaned(artifact_path, report_type, read_header(artifact_path))
+            count('parse', rows=len(df))
+    return CleanedReport(filename, table_id, df, None, list(df.columns), False, partition, artifact_path, metrics,
+                         compression, week)
+
+def upload_report(report, sink, job_id=None, resume=False):
+    # Sending the data is timed here; the load job's own time is recorded
+    # by record_load_job once it has finished
+    if report.parquet_path:
+        report.metrics.set('upload', bytes_out=os.path.getsize(report.parquet_path))
+    with report.metrics.stage('upload'):
+        return sink.start_load(report, job_id, resume)
+
+def record_load_job(metrics, job):
+    if job.started and job.ended:
+        # A delta's job is the MERGE query, which counts the rows it changed
+        rows = job.output_rows if hasattr(job, 'output_rows') else job.num_dml_affected_rows
+        metrics.set('load_job', seconds=(job.ended - job.started).total_seconds(), rows=rows)
+
+class ReportTagFilter(logging.Filter):
+    """Prefix a worker's log lines with the report it is cleaning."""
+
+    def __init__(self):
+        super().__init__()
+        self.filename = None
+
+    def filter(self, record):
+        if self.filename:
+            record.msg = f"[{self.filename}] {record.getMessage()}"
+            record.args = None
+        return True
+
+_worker_tag = ReportTagFilter()
+
+def init_worker(log_queue):
+    # Workers hand their records to the parent, which writes them to the log
+    # file, so lines from different reports never interleave mid-line
+    handler = logging.handlers.QueueHandler(log_queue)
+    handler.addFilter(_worker_tag)
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(logging.INFO)
+
+def clean_report_in_worker(filename, *args, **kwargs):
+    _worker_tag.filename = filename
+    try:
+        return clean_report(filename, *args, **kwargs)
+    finally:
+        _worker_tag.filename = None
+
+def report_label(week, filename, several_weeks=False):
+    # A backfill runs several weeks at once, so its messages name the week too
+    return f"{week} {filename}" if several_weeks else filename
+
+def finish_cleaning(label, clean, submit=None):
+    """
+    Run clean() and hand the report to submit() for upload unless submit is
+    None, reporting a cleaning failure. Returns the cleaned report and the
+    error, one of which is None.
+    """
+    try:
+        report = clean()
+        print(f"✅ {label} cleaned and saved successfully.")
+        if submit is not None:
+            submit(report)
+        return report, None
+
+    except Exception as e:
+        logging.error(f"❌ Error processing {label}: {str(e)}")
+        print(f"❌ Error processing {label}: {str(e)}")
+        return None, e
+
+def dropped_columns(records):
+    """The columns each report's projection dropped, by report, in the order first seen."""
+    dropped = {}
+    for record in records:
+        for col in record['stages'].get('parse', {}).get('dropped_columns', []):
+            dropped.setdefault(record['report'], {})[col] = None
+    return {report: list(columns) for report, columns in dropped.items()}
+
+def print_dropped_columns(dropped):
+    for report, columns in dropped.items():
+        print(f"{report} dropped {len(columns)} columns: {', '.join(columns)}")
+
+def emit_metrics(started, week, filename, status, metrics=None, **fields):
+    """Append the report's record for this run to the metrics file, and return it."""
+    if metrics is None:
+        metrics = ReportMetrics(filename.replace('.csv', ''), week)
+    record = metrics.to_record()
+    record.update(run_started=started, status=status, **fields)
+    write_metrics(record)
+    return record
+
+def skip_unchanged(files, week, manifest, rules, sink, partition=None, several_weeks=False, delta=False):
+    """
+    Drop the (filename, file_path, input_sha256) entries whose input was
+    already cleaned and loaded into sink under the same rules, and return
+    the rest.
+    """
+    pending = []
+    for filename, file_path, input_sha256 in files:
+        key = Manifest.key(week, filename.replace('.csv', ''))
+        if manifest.is_current(key, input_sha256, rules,
+                               sink.destination(report_table_id(filename, week, partition, delta))):
+            job_id = manifest.entries[key]['job_id']
+            label = report_label(week, filename, several_weeks)
+            logging.info(f"✅ {label} is unchanged since job {job_id}, skipping.")
+            print(f"✅ {label} is unchanged since job {job_id}, skipping.")
+        else:
+            pending.append((filename, file_path, input_sha256))
+    return pending
+
+def run_weeks(weeks, cleaned_folder, chunk_rows=None, workers=1, artifact='csv', force=False, compact=False,
+              budgets=None, max_uploads=None, clean_only=False, sink=None, shards=1, compare=False, delta=False,
+              projections=None):
+    """
+    Clean and upload the (filename, file_path) files of each (week,
+    partition, files) entry in weeks. Every week shares one BigQuery client,
+    one pool of cleaning workers and one pool of upload threads. With
+    max_uploads, at most that many cleaned reports wait for or are in
+    upload at once; cleaning pauses until one is done, so cleaned reports
+    can't pile up in memory. The reports are loaded into sink, BigQuery by
+    default (see sinks.py). With clean_only, nothing is uploaded and
+    BigQuery is never imported. With compare, each week's postage
+    comparison is built from its cleaned reports once they are all done.
+
+    Each report is checkpointed in the manifest as it goes. A report that
+    an earlier run cleaned but didn't finish loading is loaded from its
+    cleaned file, without cleaning it again, and a load job that run
+    submitted is picked up by its ID rather than submitted twice.
+
+    With delta, Exported Orders and Stamps Orders only upload the rows that
+    are new or changed since the weeks already loaded, and merge them into
+    one table per report type by key; the weeks need partition numbers.
+    The weeks then go one at a time in week order, each once the loads of
+    the week before are done, still sharing the client and the pools.
+    projections maps a report type to the columns it keeps (see
+    REPORT_PROJECTIONS), plus any that delta or compare read from it.
+    Returns each report's metrics record.
+    """
+    sink = sink or BigQuerySink()
+    # A re-run only redoes the reports whose input or cleaning rules changed
+    manifest = Manifest(cleaned_folder)
+    projections = {report_type: run_projection(report_type, columns, delta, compare)
+                   for report_type, columns in (projections or {}).items()}
+    rules = rules_digest([__file__, csv_ingest.__file__, report_schemas.__file__, report_specs.__file__,
+                          postage_comparison.__file__],
+                         artifact=artifact,
+                         columns={report_type: columns for report_type, columns in projections.items() if columns})
+    several_weeks = len(weeks) > 1
+    started = run_started()
+    run_id = uuid.uuid4().hex[:8]
+    records = []
+    input_hashes = {}
+    cleaned = {}  # (week, filename) -> (input_sha256, cleaned file), or None if it failed
+    resumed_from = {}
+    compression = COMPACT_PARQUET_COMPRESSION if compact else 'snappy'
+    budgets = budgets or {}
+    batches = [weeks]
+    if delta and several_weeks:
+        # Each week is compared with what the weeks before it loaded, so
+        # they go one at a time, in order
+        batches = [[entry] for entry in sorted(weeks, key=lambda entry: entry[1])]
+
+    def resumable(week, partition, filename, input_sha256):
+        """The manifest entry to resume the report from, if an earlier run got far enough."""
+        # A delta depends on the index as it is now, so it is always worked out again
+        if force or clean_only or (delta and filename.replace('.csv', '') in DELTA_KEYS):
+            return None
+        entry = manifest.resumable(Manifest.key(week, filename.replace('.csv', '')), input_sha256, rules,
+                                   sink.destination(report_table_id(filename, week, partition, delta)))
+        # Reading a whole cleaned CSV back would undo what --stream is for
+        if entry is None or (chunk_rows and entry['artifact'].endswith('.csv')):
+            return None
+        return entry
+
+    def plan(batch):
+        """The reports of batch to clean and to resume, recording the ones that are unchanged."""
+        jobs = []
+        resumes = []
+        for week, partition, files in batch:
+            pending = [(filename, file_path, file_digest(file_path)) for filename, file_path in files]
+            if not force:
+                pending = skip_unchanged(pending, week, manifest, rules, sink, partition, several_weeks, delta)
+            for filename, file_path, input_sha256 in pending:
+                input_hashes[week, filename] = input_sha256
+                entry = resumable(week, partition, filename, input_sha256)
+                if entry is not None:
+                    resumes.append((week, partition, filename, file_path, entry))
+                else:
+                    jobs.append((week, partition, filename, file_path))
+            for filename, file_path in files:
+                if (week, filename) not in input_hashes:
+                    records.append(emit_metrics(started, week, filename, 'skipped'))
+        return jobs, resumes
+
+    def clean_args(week, partition, filename, file_path):
+        return (filename, file_path, week, cleaned_folder, chunk_rows, artifact, partition, compact,
+                budgets.get(filename.replace('.csv', '')), not clean_only, shards, delta,
+                projections.get(filename.replace('.csv', '')))
+
+    def checkpoint(report, name, **fields):
+        key = Manifest.key(report.week, report.filename.replace('.csv', ''))
+        previous = manifest.entries.get(key, {})
+        if 'attempt' in previous:
+            fields.setdefault('attempt', previous['attempt'])
+        manifest.record(key, input_sha256=input_hashes[report.week, report.filename], rules=rules,
+                        table_id=sink.destination(report.table_id), artifact=report.artifact_path,
+                        checkpoint=name, **fields)
+
+    def submit(report, entry=None):
+        # The job ID is saved before the job is submitted, so a run that
+        # stops in between still finds the job next time
+        key = Manifest.key(report.week, report.filename.replace('.csv', ''))
+        resume = entry is not None and entry['checkpoint'] == 'submitted'
+        if resume:
+            job_id, attempt = entry['job_id'], entry['attempt']
+        else:
+            attempt = manifest.entries.get(key, {}).get('attempt', -1) + 1
+            job_id = load_job_id(key, input_hashes[report.week, report.filename], rules,
+                                 sink.destination(report.table_id), run_id, attempt)
+        checkpoint(report, 'submitted', job_id=job_id, attempt=attempt)
+        uploads.submit(report, partial(upload_report, report, job_id=job_id, resume=resume))
+
+    def resume(week, partition, filename, entry):
+        """Load the report from an earlier run's cleaned file; False if that can't be done."""
+        label = report_label(week, filename, several_weeks)
+        try:
+            report = resume_report(filename, entry['artifact'], week, partition, compression)
+        except Exception as e:
+            logging.warning(f"⚠️ Can't resume {label} from {entry['artifact']}, cleaning it again: {str(e)}")
+            print(f"⚠️ Can't resume {label} from {entry['artifact']}, cleaning it again: {str(e)}")
+            return False
+        logging.info(f"✅ {label} was already cleaned, loading {entry['artifact']}.")
+        print(f"✅ {label} was already cleaned, loading {entry['artifact']}.")
+        cleaned[week, filename] = (input_hashes[week, filename], report.artifact_path)
+        resumed_from[week, filename] = entry['checkpoint']
+        submit(report, entry)
+        return True
+
+    def finish_report(week, filename, clean):
+        report, error = finish_cleaning(report_label(week, filename, several_weeks), clean,
+                                        None if clean_only else submit)
+        cleaned[week, filename] = (input_hashes[week, filename], report.artifact_path) if report else None
+        if error is not None:
+            records.append(emit_metrics(started, week, filename, 'clean_failed', error=str(error)))
+        elif clean_only:
+            checkpoint(report, 'cleaned')
+            records.append(emit_metrics(started, week, filename, 'cleaned', report.metrics,
+                                        artifact=report.artifact_path))
+        # Record the uploads done so far, so an interrupted backfill keeps them
+        for report, job, error in uploads.finished() if uploads is not None else ():
+            finish_upload(report, job, error)
+
+    def finish_upload(report, job, error):
+        label = report_label(report.week, report.filename, several_weeks)
+        destination = sink.destination(report.table_id)
+        resumed = {'resumed_from': resumed_from[report.week, report.filename]} \
+            if (report.week, report.filename) in resumed_from else {}
+        if error is None:
+            print(f"✅ {label} uploaded successfully to {sink.name}: {destination}")
+            checkpoint(report, 'loaded', job_id=job.job_id)
+            if report.merge_key:
+                # The next week is compared with the rows loaded now
+                update_index(index_path(cleaned_folder, report.filename.replace('.csv', '')), report.parquet_path,
+                             report.merge_key)
+            record_load_job(report.metrics, job)
+            records.append(emit_metrics(started, report.week, report.filename, 'uploaded', report.metrics,
+                                        table_id=destination, job_id=job.job_id, **resumed))
+        else:
+            # The cleaned file is kept, so the next run only has to load it
+            logging.error(f"❌ Error processing {label}: {str(error)}")
+            print(f"❌ Error processing {label}: {str(error)}")
+            checkpoint(report, 'cleaned')
+            records.append(emit_metrics(started, report.week, report.filename, 'upload_failed', report.metrics,
+                                        table_id=destination, error=str(error), **resumed))
+
+    def sources(week, filenames):
+        """The (input_sha256, cleaned file) of each report, from this run or the last one that loaded it."""
+        found = []
+        for filename in filenames:
+            if (week, filename) in cleaned:
+                found.append(cleaned[week, filename])
+                continue
+            entry = manifest.entries.get(Manifest.key(week, filename.replace('.csv', '')))
+            found.append((entry['input_sha256'], entry['artifact'])
+                         if entry and os.path.exists(entry['artifact']) else None)
+        return found
+
+    def build(batch):
+        # Built reports read the cleaned files of a whole week, so they wait
+        # until every report is cleaned
+        for week, partition, files in batch:
+            for filename, built_from in BUILT_FROM.items():
+                inputs = sources(week, built_from)
+                if None in inputs:
+                    label = report_label(week, filename, several_weeks)
+                    needed = ' and '.join(source.replace('.csv', '') for source in built_from)
+                    logging.warning(f"⚠️ {label} needs cleaned {needed}; not built.")
+                    print(f"⚠️ {label} needs cleaned {needed}; not built.")
+                    records.append(emit_metrics(started, week, filename, 'clean_failed',
+                                                error=f"needs cleaned {needed}"))
+                    continue
+                pending = [(filename, list(zip(built_from, [artifact for digest, artifact in inputs])),
+                            sources_digest([digest for digest, artifact in inputs]))]
+                if not force:
+                    pending = skip_unchanged(pending, week, manifest, rules, sink, partition, several_weeks, delta)
+                if not pending:
+                    records.append(emit_metrics(started, week, filename, 'skipped'))
+                    continue
+                input_hashes[week, filename] = pending[0][2]
+                entry = resumable(week, partition, filename, pending[0][2])
+                if entry is None or not resume(week, partition, filename, entry):
+                    finish_report(week, filename,
+                                  partial(clean_report, *clean_args(week, partition, filename, pending[0][1])))
+
+    # One client and one pool of upload threads for the whole run, started
+    # once there is something to clean; each upload runs on its own thread
+    # as soon as its report is ready, so later reports clean while earlier
+    # ones load. The cleaning workers are likewise started once and kept.
+    uploads = None
+    pool = None
+    stack = ExitStack()
+
+    def cleaning_pool():
+        nonlocal pool
+        if pool is None:
+            log_queue = multiprocessing.Queue()
+            listener = logging.handlers.QueueListener(log_queue, *logging.getLogger().handlers,
+                                                      respect_handler_level=True)
+            listener.start()
+            stack.callback(listener.stop)
+            pool = stack.enter_context(ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                                           initargs=(log_queue,)))
+        return pool
+
+    with stack:
+        for batch in batches:
+            jobs, resumes = plan(batch)
+            if not jobs and not resumes and not compare:
+                continue
+            if uploads is None and not clean_only:
+                sink.warm()
+                uploads = LoadJobs(sink, max_workers=max_uploads, max_pending=max_uploads)
+
+            for week, partition, filename, file_path, entry in resumes:
+                if not resume(week, partition, filename, entry):
+                    jobs.append((week, partition, filename, file_path))
+
+            if workers <= 1:
+                for job in jobs:
+                    finish_report(job[0], job[2], partial(clean_report, *clean_args(*job)))
+
+            elif jobs:
+                # Only as many reports as there are workers are handed out at
+                # a time, so a stalled upload also holds back the cleaning
+                waiting = iter(jobs)
+                futures = {}
+                for job in islice(waiting, workers):
+                    futures[cleaning_pool().submit(clean_report_in_worker, *clean_args(*job))] = job
+                # A failed report only ends its own future
+                while futures:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        week, partition, filename, file_path = futures.pop(future)
+                        finish_report(week, filename, future.result)
+                        for job in islice(waiting, 1):
+                            futures[cleaning_pool().submit(clean_report_in_worker, *clean_args(*job))] = job
+
+            if compare:
+                build(batch)
+
+            if len(batches) > 1:
+                # The next week's delta is worked out against the rows these load
+                for report, job, error in uploads.drain() if uploads is not None else ():
+                    finish_upload(report, job, error)
+
+    for report, job, error in uploads.results() if uploads is not None else ():
+        finish_upload(report, job, error)
+    return records
+
+def budget_setting(convert):
+    """argparse type for [REPORT=]LIMIT; no report means every report."""
+    def parse(value):
+        report_type, _, limit = value.rpartition('=')
+        if report_type and report_type not in REPORT_TYPES:
+            raise argparse.ArgumentTypeError(f"unknown report {report_type!r}")
+        try:
+            return report_type or None, convert(limit)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"invalid limit {limit!r}")
+    return parse
+
+def error_budgets(max_bad_rows=(), max_bad_percent=()):
+    """
+    Each report type's ErrorBudget: its default from report_schemas.py, with
+    the command line's --max-bad-rows and --max-bad-percent settings on top.
+    """
+    budgets = {report_type: report_budget(report_type) for report_type in REPORT_TYPES}
+    for attribute, settings in (('max_bad_rows', max_bad_rows), ('max_bad_percent', max_bad_percent)):
+        for report_type, limit in settings or ():
+            for budget in [budgets[report_type]] if report_type else budgets.values():
+                setattr(budget, attribute, limit)
+    return budgets
+
+def projection_setting(value):
+    """argparse type for REPORT=COLUMN,COLUMN..."""
+    report_type, _, columns = value.partition('=')
+    if report_type not in REPORT_TYPES:
+        raise argparse.ArgumentTypeError(f"unknown report {report_type!r}")
+    columns = [col.strip() for col in columns.split(',') if col.strip()]
+    if not columns:
+        raise argparse.ArgumentTypeError(f"no columns given for {report_type}")
+    return report_type, columns
+
+def report_projections(settings=()):
+    """Each report type's projection: REPORT_PROJECTIONS with the command line's --keep-columns on top."""
+    projections = {report_type: REPORT_PROJECTIONS.get(report_type) for report_type in REPORT_TYPES}
+    projections.update(settings or ())
+    return projections
+
+def add_run_options(parser):
+    """The options that control how reports are cleaned and loaded."""
+    parser.add_argument('--stream', action='store_true',
+                        help="Process each file in fixed-size row chunks so memory stays flat.")
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS,
+                        help=f"Rows per chunk in streaming mode (default {DEFAULT_CHUNK_ROWS}).")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Clean up to this many reports at once in separate processes (default 1).")
+    parser.add_argument('--artifact', choices=ARTIFACT_FORMATS, default='csv',
+                        help="Format of the cleaned file. 'parquet' writes the file once and loads that "
+                             "same file into BigQuery; 'csv' (default) is easier to open by hand.")
+    parser.add_argument('--partitioned', action='store_true',
+                        help="Load each report into one table per report type, partitioned by week and "
+                             "clustered on its keys, replacing only this week's partition.")
+    parser.add_argument('--force', action='store_true',
+                        help="Clean and upload every report, even those unchanged since the last run.")
+    parser.add_argument('--compact', action='store_true',
+                        help="Hold repetitive text columns as categories and integers at their narrowest "
+                             "width, and compress Parquet with zstd. The loaded values are the same.")
+    parser.add_argument('--max-bad-rows', type=budget_setting(int), action='append', metavar='[REPORT=]N',
+                        help="Reject a report once it has more than N problematic rows, like BigQuery's "
+                             "max_bad_records. Prefix a report name (\"Stamps Orders=100\") to set it for "
+                             "that report only; may be repeated.")
+    parser.add_argument('--max-bad-percent', type=budget_setting(float), action='append',
+                        metavar='[REPORT=]PERCENT',
+                        help="Reject a report whose problematic rows are more than PERCENT of its rows. "
+                             "Same [REPORT=] form as --max-bad-rows.")
+    parser.add_argument('--clean-only', action='store_true',
+                        help="Clean and save the reports without uploading them, e.g. to check an export. "
+                             "Needs no BigQuery credentials.")
+    parser.add_argument('--shards', type=int, default=1,
+                        help="Split each file into this many pieces and parse and clean them in separate "
+                             "processes at once, for one very large export (default 1). Ignored with --stream.")
+    parser.add_argument('--compare', action='store_true',
+                        help="Also build each week's postage comparison from its cleaned Exported Orders and "
+                             "Stamps Orders, with the rows that match nothing in a side report.")
+    parser.add_argument('--delta', action='store_true',
+                        help="Upload only the Exported Orders and Stamps Orders rows that are new or changed "
+                             "since the weeks already loaded, merged by OrderId and TrackingNumber into one "
+                             "table per report. Needs --partitioned.")
+    parser.add_argument('--keep-columns', type=projection_setting, action='append',
+                        metavar='REPORT=COLUMN,COLUMN...',
+                        help="Keep only these columns of a report (cleaned names, e.g. \"Stamps Orders="
+                             "TrackingNumber,Quoted_Amount\"); the rest are skipped as the file is parsed. "
+                             "The columns the cleaning, clustering, --delta and --compare need are always "
+                             "kept. May be repeated, once per report.")
+    parser.add_argument('--sink', choices=SINKS, default='bigquery',
+                        help="Where the cleaned reports are loaded. 'sqlite' loads them into a local SQLite "
+                             "database with the same table names and replace rules, for offline runs.")
+    parser.add_argument('--sqlite-path', default=os.path.join('cleaned', SQLITE_NAME),
+                        help=f"Database file for --sink sqlite (default cleaned/{SQLITE_NAME}).")
+
+def run_options(args):
+    """run_weeks keyword arguments for the options add_run_options added."""
+    return dict(chunk_rows=args.chunk_rows if args.stream else None, workers=args.workers,
+                artifact=args.artifact, force=args.force, compact=args.compact,
+                budgets=error_budgets(args.max_bad_rows, args.max_bad_percent), clean_only=args.clean_only,
+                sink=make_sink(args.sink, args.sqlite_path), shards=args.shards, compare=args.compare,
+                delta=args.delta, projections=report_projections(args.keep_columns))
+
+def check_run_options(parser, args):
+    """Reject combinations of the options add_run_options added that can't work together."""
+    if args.delta and not args.partitioned:
+        parser.error("--delta needs --partitioned, so that every row has its week number")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Clean the weekly exports and upload them to BigQuery.")
+    add_run_options(parser)
+    args = parser.parse_args(argv)
+    check_run_options(parser, args)
+    return args
+
+def is_partition(week_num):
+    return str(week_num).strip().isdigit() and int(week_num) in WEEK_PARTITIONS
+
+def make_cleaned_folder():
     # Create cleaned folder if it doesn't exist
     cleaned_folder = os.path.join(os.getcwd(), 'cleaned')
     if not os.path.exists(cleaned_folder):
         os.makedirs(cleaned_folder)
-    
-    # Expected file names
-    expected_files = {
-        'Exported Orders.csv': process_exported_orders,
-        'Stamps Orders.csv': process_stamp_orders,
-        'ExtensivTxRegRpt.csv': process_extensiv_txregrpt
-    }
-    
-    # Process each file
-    for filename, process_func in expected_files.items():
+    return cleaned_folder
+
+def collect_files(folder_path, week=None, several_weeks=False):
+    """The (filename, file_path) of each expected file present in folder_path."""
+    files = []
+    for filename in EXPECTED_FILES:
         file_path = os.path.join(folder_path, filename)
         if os.path.exists(file_path):
-            try:
-                # Process the file
-                df = process_func(file_path, week)
-                
-                # Create output filename with week prefix
-                output_filename = f"{week} {filename}"
-                output_path = os.path.join(cleaned_folder, output_filename)
-                
-                # Save to CSV
-                df.to_csv(output_path, index=False, quoting=csv.QUOTE_ALL)
-                logging.info(f"✅ {filename} cleaned and saved successfully.")
-                print(f"✅ {filename} cleaned and saved successfully.")
-                
-                # Upload to BigQuery
-                client = bigquery.Client()
-                dataset_id = 'postage-calculator-tool.pct'
-                table_name = output_filename.replace('.csv', '').replace(' ', '_')
-                table_id = f"{dataset_id}.{table_name}"
-                
-                job_config = bigquery.LoadJobConfig(
-                    autodetect=True,
-                    write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE
-                )
-                
-                job = client.load_table_from_dataframe(df, table_id, job_config=job_config)
-                job.result()
-                
-                print(f"✅ {filename} uploaded successfully to BigQuery: {table_id}")
-                
-            except Exception as e:
-                logging.error(f"❌ Error processing {filename}: {str(e)}")
-                print(f"❌ Error processing {filename}: {str(e)}")
+            files.append((filename, file_path))
         else:
-            logging.warning(f"⚠️ File not found: {filename}")
-            print(f"⚠️ File not found: {filename}")
+            label = report_label(week, filename, several_weeks)
+            logging.warning(f"⚠️ File not found: {label}")
+            print(f"⚠️ File not found: {label}")
+    return files
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # Get folder path from user
+    folder_path = input("Please drag and drop the folder containing the CSV files: ").strip('"')
+
+    # Get week number from user and prepend "week"
+    week_num = input("Please enter the week number (e.g., 1): ")
+    week = f"week{week_num}"
+
+    # The week number names the partition it replaces
+    partition = None
+    if args.partitioned:
+        if not is_partition(week_num):
+            print(f"❌ Week number must be a whole number from {WEEK_PARTITIONS.start} to "
+                  f"{WEEK_PARTITIONS.stop - 1} to load into partitioned tables.")
+            return
+        partition = int(week_num)
+
+    cleaned_folder = make_cleaned_folder()
+
+    # Collect the files that are present
+    files = collect_files(folder_path)
+
+    records = run_weeks([(week, partition, files)], cleaned_folder, **run_options(args))
+    print_dropped_columns(dropped_columns(records))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,241 @@
+import os
+import sqlite3
+import threading
+import uuid
+from datetime import datetime, timezone
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from bigquery_uploads import get_client, warm_client
+from report_schemas import SQLITE_TYPES, WEEK_COLUMN, bigquery_schema, column_type, partitioned_table
+
+SINKS = ('bigquery', 'sqlite')
+
+SQLITE_NAME = 'warehouse.sqlite'
+
+# Rows inserted at a time when a Parquet file is loaded into SQLite
+SQLITE_BATCH_ROWS = 50000
+
+class BigQuerySink:
+    """
+    Loads cleaned reports into BigQuery over the shared client.
+    start_load() starts the load job and returns it without waiting. With
+    resume, job_id is one an earlier run recorded as submitted, and the job
+    BigQuery has under it is returned if there is one, so a load submitted
+    twice only runs once. A report with a
+    merge_key is a delta: it is loaded into a staging table and MERGEd into
+    its table, and the MERGE query is the job returned.
+    """
+
+    name = 'BigQuery'
+
+    def warm(self):
+        warm_client()
+
+    def destination(self, table_id):
+        return table_id
+
+    def start_load(self, report, job_id=None, resume=False):
+        from google.api_core.exceptions import Conflict, NotFound
+        client = get_client()
+        try:
+            if job_id and resume:
+                try:
+                    return client.get_job(job_id)
+                except NotFound:
+                    pass
+            if report.merge_key:
+                return self._merge(client, report, job_id)
+            return self._submit(client, report, job_id)
+        except Conflict:
+            # Job IDs are unique to a run, so this is the job just sent,
+            # accepted before an error hid the reply
+            return client.get_job(job_id)
+        finally:
+            if report.spool:
+                os.remove(report.parquet_path)
+
+    def _submit(self, client, report, job_id):
+        from google.cloud import bigquery
+        report_type = report.filename.replace('.csv', '')
+        schema = bigquery_schema(report_type, report.columns)
+        destination = report.table_id
+        schema_update_options = None
+        if report.partition is not None:
+            # WRITE_TRUNCATE on the week's partition replaces that week only;
+            # a column a later export adds is added to the table
+            client.create_table(partitioned_table(report_type, report.table_id, schema), exists_ok=True)
+            destination = f"{report.table_id}${report.partition}"
+            schema_update_options = [bigquery.SchemaUpdateOption.ALLOW_FIELD_ADDITION]
+
+        if report.parquet_path:
+            job_config = bigquery.LoadJobConfig(
+                source_format=bigquery.SourceFormat.PARQUET,
+                schema=schema,
+                schema_update_options=schema_update_options,
+                write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE
+            )
+            # The file is fully sent once load_table_from_file returns
+            with open(report.parquet_path, 'rb') as parquet_file:
+                return client.load_table_from_file(parquet_file, destination, job_id=job_id, job_config=job_config)
+
+        job_config = bigquery.LoadJobConfig(
+            schema=schema,
+            schema_update_options=schema_update_options,
+            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE
+        )
+
+        return client.load_table_from_dataframe(report.df, destination, job_id=job_id, job_config=job_config,
+                                                parquet_compression=report.compression)
+
+    def _merge(self, client, report, job_id):
+        from google.cloud import bigquery
+        report_type = report.filename.replace('.csv', '')
+        schema = bigquery_schema(report_type, report.columns)
+        table = bigquery.Table(report.table_id, schema=schema)
+        table.clustering_fields = [report.merge_key]
+        table = client.create_table(table, exists_ok=True)
+        existing = {field.name for field in table.schema}
+        if any(field.name not in existing for field in schema):
+            # A column a later export adds is added to the table
+            table.schema = list(table.schema) + [field for field in schema if field.name not in existing]
+            client.update_table(table, ['schema'])
+
+        # The staging table is replaced by every load, so loading it again is harmless
+        staging = f"{report.table_id}_staging"
+        job_config = bigquery.LoadJobConfig(
+            source_format=bigquery.SourceFormat.PARQUET,
+            schema=schema,
+            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE
+        )
+        with open(report.parquet_path, 'rb') as parquet_file:
+            client.load_table_from_file(parquet_file, staging, job_config=job_config).result()
+
+        # A week loaded out of order never overwrites a later week's rows
+        columns = [f"`{col}`" for col in report.columns]
+        return client.query(f"""
+            MERGE `{report.table_id}` T
+            USING `{staging}` S
+            ON T.`{report.merge_key}` = S.`{report.merge_key}`
+            WHEN MATCHED AND S.`{WEEK_COLUMN}` >= T.`{WEEK_COLUMN}` THEN
+              UPDATE SET {', '.join(f"{col} = S.{col}" for col in columns)}
+            WHEN NOT MATCHED THEN
+              INSERT ({', '.join(columns)}) VALUES ({', '.join(f"S.{col}" for col in columns)})
+        """, job_id=job_id)
+
+class LocalLoadJob:
+    """A finished load into a local database, with the load job fields the runs record."""
+
+    def __init__(self, started, ended, output_rows, job_id=None):
+        self.job_id = job_id or f"local_{uuid.uuid4().hex}"
+        self.started = started
+        self.ended = ended
+        self.output_rows = output_rows
+
+    def result(self):
+        return self
+
+class SQLiteSink:
+    """
+    Loads cleaned reports into a local SQLite database instead of BigQuery,
+    so a whole run can be timed and checked offline. Each table is named
+    after its BigQuery table (week12_Exported_Orders, Exported_Orders...)
+    and has the declared column types. A load replaces the whole table, or
+    with a partition only that week's rows, adding any new columns, as the
+    BigQuery load jobs do. A delta is upserted on its merge_key, and a
+    week never overwrites a later week's row. Each load is one transaction,
+    so a failed load leaves the table as it was, and loading the same
+    report again gives the same table.
+    """
+
+    name = 'SQLite'
+
+    def __init__(self, path):
+        self.path = path
+        # SQLite takes one writer at a time, so loads queue up here
+        self._lock = threading.Lock()
+
+    def warm(self):
+        pass
+
+    @staticmethod
+    def table_name(table_id):
+        return table_id.rsplit('.', 1)[-1]
+
+    def destination(self, table_id):
+        return f"{self.path}:{self.table_name(table_id)}"
+
+    def start_load(self, report, job_id=None, resume=False):
+        started = datetime.now(timezone.utc)
+        report_type = report.filename.replace('.csv', '')
+        table = self.table_name(report.table_id)
+        columns = ', '.join(f'"{col}" {SQLITE_TYPES[column_type(report_type, col)]}' for col in report.columns)
+        names = ', '.join(f'"{col}"' for col in report.columns)
+        placeholders = ', '.join('?' for _ in report.columns)
+        insert = f'INSERT INTO "{table}" ({names}) VALUES ({placeholders})'
+        if report.merge_key:
+            updates = ', '.join(f'"{col}" = excluded."{col}"' for col in report.columns)
+            insert += (f' ON CONFLICT("{report.merge_key}") DO UPDATE SET {updates}'
+                       f' WHERE excluded."{WEEK_COLUMN}" >= "{table}"."{WEEK_COLUMN}"')
+
+        try:
+            with self._lock:
+                connection = sqlite3.connect(self.path, isolation_level=None)
+                try:
+                    connection.execute('BEGIN')
+                    if report.partition is None and not report.merge_key:
+                        connection.execute(f'DROP TABLE IF EXISTS "{table}"')
+                    connection.execute(f'CREATE TABLE IF NOT EXISTS "{table}" ({columns})')
+                    if report.partition is not None or report.merge_key:
+                        existing = {row[1] for row in connection.execute(f'PRAGMA table_info("{table}")')}
+                        for col in report.columns:
+                            if col not in existing:
+                                connection.execute(f'ALTER TABLE "{table}" ADD COLUMN "{col}" '
+                                                   f'{SQLITE_TYPES[column_type(report_type, col)]}')
+                    if report.merge_key:
+                        connection.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS "{table}_{report.merge_key}" '
+                                           f'ON "{table}" ("{report.merge_key}")')
+                    elif report.partition is not None:
+                        connection.execute(f'DELETE FROM "{table}" WHERE "{WEEK_COLUMN}" = ?', (report.partition,))
+
+                    output_rows = 0
+                    for df in self._frames(report):
+                        connection.executemany(insert, sqlite_rows(df))
+                        output_rows += len(df)
+                    connection.execute('COMMIT')
+                except BaseException:
+                    if connection.in_transaction:
+                        connection.execute('ROLLBACK')
+                    raise
+                finally:
+                    connection.close()
+        finally:
+            if report.spool:
+                os.remove(report.parquet_path)
+
+        return LocalLoadJob(started, datetime.now(timezone.utc), output_rows, job_id)
+
+    @staticmethod
+    def _frames(report):
+        if report.parquet_path is None:
+            yield report.df
+            return
+        for batch in pq.ParquetFile(report.parquet_path).iter_batches(batch_size=SQLITE_BATCH_ROWS):
+            yield batch.to_pandas()
+
+def sqlite_rows(df):
+    """The rows of df as tuples SQLite can store, with None for missing values."""
+    values = []
+    for col in df.columns:
+        series = df[col]
+        if pd.api.types.is_datetime64_any_dtype(series):
+            # Stored as text in the same form as the cleaned CSV
+            series = series.dt.strftime('%Y-%m-%d %H:%M:%S')
+        values.append(series.astype(object).where(series.notna(), None))
+    return zip(*values)
+
+def make_sink(name='bigquery', sqlite_path=None):
+    if name == 'sqlite':
+        return SQLiteSink(sqlite_path)
+    return BigQuerySink()
@@ -0,0 +1,28 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark
+
+
+@pytest.fixture
+def export(tmp_path):
+    """Write a seeded synthetic export (see benchmark.py) and return its path."""
+    def write(report_type, rows=2000, seed=7, folder=None):
+        layout, ragged = benchmark.REPORTS[report_type]
+        path = os.path.join(folder or tmp_path, f"{report_type}.csv")
+        benchmark.generate_csv(path, layout, rows, seed, ragged)
+        return path
+    return write
+
+
+@pytest.fixture
+def run_script(tmp_path, monkeypatch):
+    # run_script.py logs to data_cleaning.log and its runs write
+    # run_metrics.jsonl in the working directory, so keep both in tmp_path
+    monkeypatch.chdir(tmp_path)
+    import run_script
+    return run_script
@@ -0,0 +1,68 @@
+from functools import partial
+
+import pandas as pd
+import pytest
+
+import csv_ingest
+from csv_ingest import read_header, read_rows
+from error_budget import ErrorBudget, TooManyBadRows
+from report_specs import EXPORTED_ORDERS, STAMPS_ORDERS, read_report, report_plan
+
+RAGGED = b'A,B,C\n1,2,3\n4,5\n6,7,8,9\n"x y",z,w\n'
+
+
+def write(tmp_path, data):
+    path = tmp_path / 'report.csv'
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_ragged_rows_are_padded_or_truncated(tmp_path):
+    path = write(tmp_path, RAGGED)
+    df, problematic_rows = read_rows(path, read_header(path), 3)
+    assert df.values.tolist() == [['1', '2', '3'], ['4', '5', ''], ['6', '7', '8'], ['x y', 'z', 'w']]
+    assert problematic_rows == [(2, ['4', '5']), (3, ['6', '7', '8', '9'])]
+
+
+def test_blank_lines_are_skipped(tmp_path):
+    path = write(tmp_path, RAGGED.replace(b'4,5\n', b'4,5\n\n'))
+    df, problematic_rows = read_rows(path, read_header(path), 3)
+    assert df.values.tolist() == [['1', '2', '3'], ['4', '5', ''], ['6', '7', '8'], ['x y', 'z', 'w']]
+    # The blank line still counts as a row
+    assert problematic_rows == [(2, ['4', '5']), (4, ['6', '7', '8', '9'])]
+
+
+@pytest.mark.parametrize('blank_line', [False, True])
+def test_byte_order_mark_is_dropped(tmp_path, blank_line):
+    data = RAGGED.replace(b'4,5\n', b'4,5\n\n') if blank_line else RAGGED
+    path = write(tmp_path, b'\xef\xbb\xbf' + data)
+    headers = read_header(path)
+    assert headers == ['A', 'B', 'C']
+    df, _ = read_rows(path, headers, 3)
+    assert df.values.tolist()[0] == ['1', '2', '3']
+
+
+@pytest.mark.parametrize('spec', [EXPORTED_ORDERS, STAMPS_ORDERS], ids=lambda spec: spec.report_type)
+def test_shards_match_one_piece(export, monkeypatch, spec):
+    path = export(spec.report_type, rows=6000)
+    monkeypatch.setattr(csv_ingest, 'shard_ranges', partial(csv_ingest.shard_ranges, min_shard_bytes=1 << 16))
+    assert len(csv_ingest.shard_ranges(path, 4)) == 4
+
+    plan = report_plan(spec, path)
+    whole, whole_problems = read_report(plan, path)
+    sharded, sharded_problems = read_report(plan, path, shards=4)
+    pd.testing.assert_frame_equal(sharded, whole)
+    assert sharded_problems == whole_problems
+
+
+def test_budget_gives_up_at_the_row_that_exceeds_it(tmp_path):
+    path = write(tmp_path, b'A,B,C\n' + b'1,2\n' * 3 + b'1,2,3\n' * 1000)
+    with pytest.raises(TooManyBadRows, match='at row 2'):
+        read_rows(path, read_header(path), 3, ErrorBudget(max_bad_rows=1))
+
+
+def test_budget_that_holds_reads_the_whole_file(tmp_path):
+    path = write(tmp_path, b'A,B,C\n' + b'1,2\n' * 3 + b'1,2,3\n' * 1000)
+    df, problematic_rows = read_rows(path, read_header(path), 3, ErrorBudget(max_bad_rows=3))
+    assert len(df) == 1003
+    assert len(problematic_rows) == 3
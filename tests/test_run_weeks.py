@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+from sinks import SQLiteSink
+
+REPORTS = ['Exported Orders', 'Stamps Orders']
+
+
+@pytest.fixture
+def week(export, tmp_path):
+    """A week folder with Exported Orders and Stamps Orders, and an empty cleaned folder."""
+    folder = tmp_path / 'week5'
+    folder.mkdir()
+    files = [(f"{report_type}.csv", export(report_type, folder=str(folder))) for report_type in REPORTS]
+    cleaned = tmp_path / 'cleaned'
+    cleaned.mkdir()
+    return files, str(cleaned)
+
+
+def statuses(records):
+    return {record['report']: record['status'] for record in records}
+
+
+def test_rerun_resumes_cleaned_reports_and_skips_loaded_ones(run_script, week, tmp_path):
+    files, cleaned = week
+    weeks = [('week5', None, files)]
+    sink = SQLiteSink(str(tmp_path / 'db.sqlite'))
+
+    first = run_script.run_weeks(weeks, cleaned, clean_only=True, sink=sink)
+    assert statuses(first) == {report_type: 'cleaned' for report_type in REPORTS}
+    assert not os.path.exists(sink.path)
+
+    second = run_script.run_weeks(weeks, cleaned, sink=sink)
+    assert statuses(second) == {report_type: 'uploaded' for report_type in REPORTS}
+    assert {record['resumed_from'] for record in second} == {'cleaned'}
+
+    third = run_script.run_weeks(weeks, cleaned, sink=sink)
+    assert statuses(third) == {report_type: 'skipped' for report_type in REPORTS}
+
+
+def test_same_delta_week_again_loads_no_rows(run_script, week, tmp_path):
+    files, cleaned = week
+    weeks = [('week5', 5, files)]
+    sink = SQLiteSink(str(tmp_path / 'db.sqlite'))
+
+    first = run_script.run_weeks(weeks, cleaned, sink=sink, delta=True)
+    assert all(record['stages']['delta']['new'] > 0 for record in first)
+
+    second = run_script.run_weeks(weeks, cleaned, sink=sink, delta=True, force=True)
+    assert statuses(second) == {report_type: 'uploaded' for report_type in REPORTS}
+    for record in second:
+        assert record['stages']['delta']['new'] == 0
+        assert record['stages']['delta']['changed'] == 0
@@ -0,0 +1,38 @@
+import sqlite3
+
+import pandas as pd
+
+from sinks import SQLiteSink
+
+
+def delta_report(run_script, week, rows):
+    df = pd.DataFrame(rows, columns=['TrackingNumber', 'Quoted_Amount'])
+    df['Week'] = week
+    return run_script.CleanedReport('Stamps Orders.csv', 'pct.Stamps_Orders', df, None, list(df.columns), False,
+                                    week, None, None, None, f'week{week}', merge_key='TrackingNumber')
+
+
+def table(path):
+    with sqlite3.connect(path) as connection:
+        return sorted(connection.execute('SELECT TrackingNumber, Quoted_Amount, Week FROM Stamps_Orders'))
+
+
+def test_delta_upserts_by_merge_key(run_script, tmp_path):
+    path = str(tmp_path / 'db.sqlite')
+    sink = SQLiteSink(path)
+    sink.start_load(delta_report(run_script, 2, [('T1', 1.0), ('T2', 2.0)])).result()
+    sink.start_load(delta_report(run_script, 3, [('T1', 5.0), ('T3', 3.0)])).result()
+    assert table(path) == [('T1', 5.0, 3), ('T2', 2.0, 2), ('T3', 3.0, 3)]
+
+    # An earlier week never overwrites a later week's row
+    sink.start_load(delta_report(run_script, 1, [('T1', 9.0), ('T4', 4.0)])).result()
+    assert table(path) == [('T1', 5.0, 3), ('T2', 2.0, 2), ('T3', 3.0, 3), ('T4', 4.0, 1)]
+
+
+def test_loading_a_delta_again_changes_nothing(run_script, tmp_path):
+    path = str(tmp_path / 'db.sqlite')
+    sink = SQLiteSink(path)
+    report = delta_report(run_script, 2, [('T1', 1.0), ('T2', 2.0)])
+    sink.start_load(report).result()
+    sink.start_load(report).result()
+    assert table(path) == [('T1', 1.0, 2), ('T2', 2.0, 2)]
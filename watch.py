@@ -0,0 +1,159 @@
+import argparse
+import logging
+import os
+import time
+from backfill import DEFAULT_UPLOADS, DEFAULT_WEEK_PATTERN, find_week_folders, print_summary, summary_rows
+from run_script import (EXPECTED_FILES, WEEK_PARTITIONS, add_run_options, check_run_options, dropped_columns,
+                        is_partition, make_cleaned_folder, run_options, run_weeks)
+
+# Seconds between looks at the drop folder
+DEFAULT_INTERVAL = 10
+
+# Seconds a file's size and modification time must stay the same before it
+# counts as completely written
+DEFAULT_SETTLE = 60
+
+class DropFolder:
+    """
+    The expected exports in a drop folder, and which of them have settled
+    since they were last handed out. With a week number the folder holds
+    that week's files; without one it holds one folder per week, matched by
+    pattern, and new week folders are picked up as they appear.
+
+    A file settles once its size and modification time have stayed the same
+    for settle seconds and over at least two looks, so a file that is still
+    being copied in is left alone even if the copy keeps its old timestamp.
+    """
+
+    def __init__(self, root, week_num=None, pattern=DEFAULT_WEEK_PATTERN, settle=DEFAULT_SETTLE,
+                 partitioned=False):
+        self.root = root
+        self.week_num = week_num
+        self.pattern = pattern
+        self.settle = settle
+        self.partitioned = partitioned
+        self._seen = {}  # path -> ((size, mtime), time it was first seen like that)
+        self._done = {}  # path -> (size, mtime) last handed out
+        self._ignored = set()
+        self._first_look = True
+
+    def week_folders(self):
+        if self.week_num is not None:
+            return [(self.root, self.week_num)]
+        week_folders = []
+        for folder, week_num in find_week_folders(self.root, self.pattern):
+            if self.partitioned and not is_partition(week_num):
+                if folder not in self._ignored:
+                    self._ignored.add(folder)
+                    logging.warning(f"⚠️ Ignoring {folder}: week numbers must be from {WEEK_PARTITIONS.start} "
+                                    f"to {WEEK_PARTITIONS.stop - 1} to load into partitioned tables.")
+                    print(f"⚠️ Ignoring {folder}: week numbers must be from {WEEK_PARTITIONS.start} "
+                          f"to {WEEK_PARTITIONS.stop - 1} to load into partitioned tables.")
+                continue
+            week_folders.append((folder, week_num))
+        return week_folders
+
+    def settled(self, now=None):
+        """
+        A (week, partition, files) entry for each week with files that have
+        settled since the last call, ready for run_weeks().
+        """
+        now = time.time() if now is None else now
+        weeks = []
+        for folder, week_num in self.week_folders():
+            files = []
+            for filename in EXPECTED_FILES:
+                path = os.path.join(folder, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    self._seen.pop(path, None)
+                    self._done.pop(path, None)
+                    continue
+                signature = (stat.st_size, stat.st_mtime_ns)
+                previous = self._seen.get(path)
+                if previous is None or previous[0] != signature:
+                    # Files already there when watching starts have been still since they were written
+                    since = min(now, stat.st_mtime) if self._first_look else now
+                    self._seen[path] = (signature, since)
+                    continue
+                if now - previous[1] < self.settle or self._done.get(path) == signature:
+                    continue
+                self._done[path] = signature
+                files.append((filename, path))
+            if files:
+                weeks.append((f"week{week_num}", week_num if self.partitioned else None, files))
+        self._first_look = False
+        return weeks
+
+    def retry(self, path, now=None):
+        """Hand path out again once it has been left alone for another settle period."""
+        self._done.pop(path, None)
+        if path in self._seen:
+            self._seen[path] = (self._seen[path][0], time.time() if now is None else now)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Watch a drop folder and clean and upload each export once it has been fully written.")
+    parser.add_argument('folder',
+                        help="Folder the exports are dropped into: one folder per week (week1, week2...), or "
+                             "the week's files themselves with --week.")
+    parser.add_argument('--week', type=int, metavar='N',
+                        help="The files in folder are week N's.")
+    parser.add_argument('--pattern', default=DEFAULT_WEEK_PATTERN,
+                        help="Regular expression the week folders must match; its first group is the week "
+                             "number (default: week1, Week 12, week_07...).")
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL,
+                        help=f"Seconds between looks at the folder (default {DEFAULT_INTERVAL}).")
+    parser.add_argument('--settle', type=float, default=DEFAULT_SETTLE,
+                        help="Seconds a file must go unchanged before it is cleaned, so a half-written "
+                             f"export is never read (default {DEFAULT_SETTLE}).")
+    parser.add_argument('--uploads', type=int, default=DEFAULT_UPLOADS,
+                        help=f"Load jobs running at once (default {DEFAULT_UPLOADS}).")
+    add_run_options(parser)
+    args = parser.parse_args(argv)
+    check_run_options(parser, args)
+    if args.week is not None and args.partitioned and not is_partition(args.week):
+        parser.error(f"--week must be from {WEEK_PARTITIONS.start} to {WEEK_PARTITIONS.stop - 1} to load "
+                     f"into partitioned tables")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    drop = DropFolder(args.folder.strip('"'), args.week, args.pattern, args.settle, args.partitioned)
+    cleaned_folder = make_cleaned_folder()
+    options = run_options(args)
+
+    logging.info(f"Watching {drop.root} for new exports")
+    print(f"👀 Watching {drop.root} for new exports; press Ctrl+C to stop.")
+    try:
+        while True:
+            weeks = drop.settled()
+            if weeks:
+                paths = {(week, filename): path for week, partition, files in weeks for filename, path in files}
+                labels = ', '.join(f"{week} {filename}" for week, filename in paths)
+                logging.info(f"Settled: {labels}")
+                start = time.perf_counter()
+                try:
+                    records = run_weeks(weeks, cleaned_folder, max_uploads=args.uploads, **options)
+                except Exception as e:
+                    # Keep watching; the files go again once they have sat for another settle period
+                    logging.error(f"❌ Error processing {labels}: {str(e)}")
+                    print(f"❌ Error processing {labels}: {str(e)}")
+                    for path in paths.values():
+                        drop.retry(path)
+                else:
+                    print_summary(summary_rows(records, []), time.perf_counter() - start,
+                                  dropped_columns(records))
+                    # A failed load may be BigQuery's fault rather than the file's
+                    for record in records:
+                        path = paths.get((record['week'], f"{record['report']}.csv"))
+                        if record['status'] == 'upload_failed' and path:
+                            drop.retry(path)
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        logging.info("Stopped watching")
+        print("\nStopped watching.")
+
+if __name__ == "__main__":
+    main()